@@ -0,0 +1,111 @@
+"""
+Decode cost of a block response on the two paths used by `near_rpc`:
+
+- network: POST to a local HTTP server serving a block-sized JSON body,
+  through the pooled client.
+- cache hit: read from the SQLite store vs the old `.memo` one-file-per-call
+  layout.
+
+Each path is measured with the stdlib `json` and with `fastjson` (orjson
+when installed), with and without building a DotMap.
+
+$> python3 benchmarks/bench_json.py [iterations]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'near_rpc'))
+
+from dotmap import DotMap  # noqa: E402
+
+import fastjson  # noqa: E402
+import store  # noqa: E402
+from client import Client  # noqa: E402
+
+
+def fake_block(height):
+    h = 'DxBRTW2Jr8rqHGGoXqXEoHGXmAMfrLhUpTR3eYvu47qQ'
+    header = {f'field_{i}': h for i in range(30)}
+    header.update(height=height, hash=h, prev_hash=h, epoch_id=h, next_epoch_id=h,
+                  block_merkle_root=h, timestamp=str(1630000000000000000 + height),
+                  approvals=[f'ed25519:{h}{h}' for _ in range(100)])
+    chunks = [{f'field_{i}': h for i in range(20)} for _ in range(4)]
+    return {'jsonrpc': '2.0', 'id': 'dontcare', 'result': {'author': 'node.near', 'header': header, 'chunks': chunks}}
+
+
+def serve(body):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(name, func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<40} {iterations / elapsed:>10.0f} ops/s {elapsed / iterations * 1e6:>10.1f} us/op')
+
+
+def main(iterations):
+    print(f'fastjson backend: {fastjson.BACKEND}')
+    body = json.dumps(fake_block(1)).encode()
+    print(f'block size: {len(body)} bytes\n')
+
+    server = serve(body)
+    client = Client(f'http://127.0.0.1:{server.server_port}/')
+    payload = fastjson.dumps({'method': 'block', 'params': {'block_id': 1}})
+
+    measure('network json + DotMap',
+            lambda _: DotMap(json.loads(client.post(payload).content)), iterations)
+    measure('network fastjson + DotMap',
+            lambda _: DotMap(fastjson.loads(client.post(payload).content)), iterations)
+    measure('network fastjson',
+            lambda _: fastjson.loads(client.post(payload).content), iterations)
+    server.shutdown()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, 'block'))
+        db = store.Store(os.path.join(folder, 'memo.sqlite'))
+        rows = []
+        for i in range(iterations):
+            value = fake_block(i)
+            with open(os.path.join(folder, 'block', str(i)), 'w') as f:
+                json.dump(value, f, indent=2)
+            rows.append(('block', str(i), value))
+        db.put_many(rows)
+
+        def memo_file(i, loads):
+            with open(os.path.join(folder, 'block', str(i)), 'rb') as f:
+                return loads(f.read())
+
+        print()
+        measure('.memo file json + DotMap',
+                lambda i: DotMap(memo_file(i, json.loads)), iterations)
+        measure('.memo file fastjson',
+                lambda i: memo_file(i, fastjson.loads), iterations)
+        measure('store + DotMap',
+                lambda i: DotMap(db.get('block', str(i))), iterations)
+        measure('store', lambda i: db.get('block', str(i)), iterations)
+        db.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
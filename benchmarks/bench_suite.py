@@ -0,0 +1,292 @@
+"""
+Offline benchmark suite. Prints one JSON document with the results, to
+compare runs between releases:
+
+    python3 benchmarks/bench_suite.py > before.json
+    python3 benchmarks/bench_suite.py --entries 1000000 --only cache > after.json
+
+Cases:
+
+- block_fetch_*: `near_rpc.block` / `iter_blocks` against `fake_server`,
+  with empty caches (cold), then served from disk and from memory (warm).
+- cache_*: hit throughput of the memory tier of `policy.cached`, of
+  `utils.memo` (SQLite store) and of `utils.persist_to_file` (LogStore),
+  each holding `--entries` entries.
+- borsh_*: decoding `check_near_block_proof.BLOCK_PROOF` with `Borsh` and
+  the validator list in `parse_borsh.data` with `BorshView`.
+- merkle_*: `debug_near_block_proof.reconstruct` over `--merkle-size`
+  headers from a `HeaderStore`, and `get_range_forward` over cached blocks,
+  then again over the subtree hashes it stored.
+
+Blocks are synthetic unless `--fixtures` points to a folder of recorded
+responses (`.memo` layout, see `fake_server.py`). Everything runs in a
+temporary folder, so the caches of the working directory are not touched.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# The root scripts import the `near_rpc` package, whose modules import each
+# other by their bare names.
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'near_rpc'))
+
+import base58 as b58  # noqa: E402
+
+import debug_near_block_proof as merkle  # noqa: E402
+import fake_server  # noqa: E402
+import fastjson  # noqa: E402
+import index as header_index  # noqa: E402
+import near_rpc  # noqa: E402
+import policy as cache_policy  # noqa: E402
+import store  # noqa: E402
+import utils  # noqa: E402
+from bench_json import fake_block  # noqa: E402
+from header import BlockHeader  # noqa: E402
+from headerstore import HeaderStore  # noqa: E402
+from logstore import LogStore  # noqa: E402
+
+
+def result(ops, seconds, **extra):
+    return dict(ops=ops, seconds=seconds, ops_per_sec=ops / seconds if seconds else None,
+                us_per_op=seconds / ops * 1e6 if ops else None, **extra)
+
+
+def measure(func, args, repeat=1, **extra):
+    """Call `func` on every element of `args`, `repeat` times. Keeps the
+    fastest pass."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result(len(args), best, **extra)
+
+
+def block_hash(height):
+    return b58.b58encode(hashlib.sha256(str(height).encode()).digest()).decode()
+
+
+def write_fixtures(folder, start, count):
+    """Chain of `count` synthetic blocks from `start` in `.memo` layout."""
+    os.makedirs(os.path.join(folder, 'block'), exist_ok=True)
+    for height in range(start, start + count):
+        value = fake_block(height)
+        value['result']['header'].update(hash=block_hash(height), prev_hash=block_hash(height - 1))
+        data = fastjson.dumps(value)
+        for key in (str(height), block_hash(height)):
+            with open(os.path.join(folder, 'block', key), 'wb') as f:
+                f.write(data)
+
+
+def fixture_heights(folder):
+    return sorted(int(name) for name in os.listdir(os.path.join(folder, 'block')) if name.isdigit())
+
+
+def bench_block_fetch(args, results):
+    folder = args.fixtures
+    if folder is None:
+        folder = os.path.abspath('fixtures')
+        write_fixtures(folder, near_rpc.GENESIS_HEIGHT, args.blocks)
+    heights = fixture_heights(folder)[:args.blocks]
+    half = len(heights) // 2
+
+    server = fake_server.serve(fake_server.Fixtures(folder, final_height=heights[-1]),
+                               fake_server.Faults(latency=args.latency))
+    near_rpc.configure([dict(url=f'http://127.0.0.1:{server.server_port}/', archival=True)])
+
+    start = time.perf_counter()
+    fetched = sum(1 for _ in near_rpc.iter_blocks(heights[0], heights[half - 1] + 1))
+    results['block_fetch_cold_iter_blocks'] = result(fetched, time.perf_counter() - start)
+    results['block_fetch_cold_sequential'] = measure(near_rpc.block, heights[half:])
+    results['block_fetch_warm_disk'] = measure(near_rpc.block.raw, heights[:half], args.repeat)
+    for height in heights[:half]:
+        near_rpc.block(height)
+    results['block_fetch_warm_memory'] = measure(near_rpc.block, heights[:half], args.repeat)
+
+    if args.fixtures is None:
+        size = 1 << (half.bit_length() - 1)
+        results['merkle_range_forward'] = measure(
+            lambda size: merkle.get_range_forward(heights[0], size), [size], leaves=size)
+        # Served by the subtree hashes stored by the first pass.
+        saved = merkle.leaves_saved()
+        results['merkle_range_forward_memo'] = measure(
+            lambda size: merkle.get_range_forward(heights[0], size), [size], args.repeat, leaves=size)
+        results['merkle_range_forward_memo']['leaves_saved'] = merkle.leaves_saved() - saved
+
+    server.shutdown()
+
+
+def bench_cache(args, results):
+    rng = random.Random(args.seed)
+    entries = args.entries
+    lookups = [rng.randrange(entries) for _ in range(min(entries, args.lookups))]
+    value = {'jsonrpc': '2.0', 'id': 'dontcare', 'result': {'result': list(range(32)), 'logs': [],
+                                                            'block_height': 1, 'block_hash': block_hash(1)}}
+
+    # Memory tier of `policy.cached`; hash arguments are always permanent.
+    policy = cache_policy.Policy(fetch_final_height=lambda: 0)
+
+    @policy.cached(maxsize=entries)
+    def block(block_id):
+        return value
+
+    keys = [block_hash(i) for i in range(entries)]
+    store.default().put_many(('block', utils.memo_key((key,)), value) for key in keys)
+    for key in keys:
+        block(key)
+    results['cache_policy_memory'] = measure(block, [keys[i] for i in lookups], args.repeat, entries=entries)
+
+    # Disk tier: `utils.memo` over the SQLite store.
+    @utils.memo
+    def call_function(ix):
+        raise AssertionError('benchmark lookups must hit')
+
+    store.default().put_many(('call_function', utils.memo_key((i,)), value) for i in range(entries))
+    store.default().flush()
+    results['cache_memo_store'] = measure(call_function, lookups, args.repeat, entries=entries)
+
+    # `persist_to_file` over LogStore, including the load of the index.
+    path = os.path.abspath('persist.log')
+    LogStore._create(path, ((pickle.dumps([(i,), {}]), pickle.dumps(value))
+                            for i in range(entries)))
+
+    start = time.perf_counter()
+    persisted = utils.persist_to_file(path)(call_function)
+    persisted(0)
+    results['cache_persist_to_file_load'] = dict(entries=entries, seconds=time.perf_counter() - start)
+    results['cache_persist_to_file'] = measure(persisted, lookups, args.repeat, entries=entries)
+
+
+def bench_borsh(args, results):
+    import check_near_block_proof as cnbp
+    with contextlib.redirect_stdout(io.StringIO()):
+        import parse_borsh
+    proof = bytes.fromhex(cnbp.BLOCK_PROOF)
+    validators = parse_borsh.data.data
+
+    def decode_proof(_):
+        data = cnbp.Borsh(proof)
+        cnbp.FullOutcomeProof.decode(data)
+        data.done()
+
+    def decode_proof_path(_):
+        cnbp.MerklePath.decode(cnbp.Borsh(proof))
+
+    def decode_validators(_):
+        data = parse_borsh.BorshView(validators)
+        for _ in range(data.decodeU32()):
+            data.decodeBlockProducer()
+        assert data.done()
+
+    iterations = [None] * args.iterations
+    for name, func in [('borsh_block_proof', decode_proof),
+                       ('borsh_block_proof_outcome_path', decode_proof_path),
+                       ('borsh_validators', decode_validators)]:
+        try:
+            results[name] = measure(func, iterations, args.repeat)
+        except Exception as e:
+            # Keep going: a decoder that rejects its input is a result too.
+            results[name] = dict(error=f'{type(e).__name__}: {e}')
+
+
+def bench_merkle(args, results):
+    genesis = near_rpc.GENESIS_HEIGHT
+    headers = HeaderStore(os.path.abspath('headers'), genesis=genesis)
+    for height in range(genesis, genesis + args.merkle_size):
+        digest = hashlib.sha256(str(height).encode()).digest()
+        headers.put(BlockHeader(height, digest, digest, digest, None, digest, height))
+    headers.flush()
+
+    height = genesis + args.merkle_size - 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['merkle_reconstruct'] = measure(
+            lambda _: merkle.reconstruct(height, args.merkle_size, headers), [None], args.repeat,
+            leaves=args.merkle_size)
+    headers.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+CASES = {
+    'block_fetch': bench_block_fetch,
+    'cache': bench_cache,
+    'borsh': bench_borsh,
+    'merkle': bench_merkle,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='Comma separated cases: ' + ','.join(CASES))
+    parser.add_argument('--fixtures', help='Folder with recorded responses (.memo layout)')
+    parser.add_argument('--blocks', type=int, default=2048, help='Blocks fetched in block_fetch')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added by the fake server')
+    parser.add_argument('--entries', type=int, default=100000, help='Entries in each cache')
+    parser.add_argument('--lookups', type=int, default=100000, help='Lookups per cache case')
+    parser.add_argument('--iterations', type=int, default=10000, help='Decodes per Borsh case')
+    parser.add_argument('--merkle-size', type=int, default=1 << 16, help='Leaves in merkle_reconstruct')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes per warm case; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the JSON here instead of stdout')
+    args = parser.parse_args()
+    if args.fixtures is not None:
+        args.fixtures = os.path.abspath(args.fixtures)
+
+    cases = args.only.split(',') if args.only else list(CASES)
+    for case in cases:
+        if case not in CASES:
+            parser.error(f'Unknown case {case}')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            for case in cases:
+                CASES[case](args, results)
+        finally:
+            store.default().close()
+            header_index.default().close()
+            os.chdir(cwd)
+
+    report = dict(
+        meta=dict(
+            commit=git_commit(),
+            time=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            fastjson=fastjson.BACKEND,
+            args={k: v for k, v in vars(args).items() if k != 'out'},
+        ),
+        results=results,
+    )
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,11 @@
 import base58 as b58
 import hashlib
 
-from near_rpc import block as get_block, light_client_proof
+from near_rpc import GENESIS_HEIGHT, block as get_block, iter_blocks, light_client_proof, nearest_block_at_or_after, \
+    nearest_block_at_or_before
+from near_rpc import epochs, metrics
+from near_rpc.search import change_points
+from near_rpc.utils import memo_load, memo_store
 
 
 def decode(value):
@@ -21,17 +25,43 @@ def encode(value):
 
 
 def _get_next_block(block_id):
-    cur = get_block(block_id)
+    header = nearest_block_at_or_after(block_id)
+    if header is None:
+        raise ValueError(f'No final block at or after {block_id}')
+    return get_block(header.height)
 
-    if 'error' in cur:
-        if cur.error.cause.name == 'UNKNOWN_BLOCK':
-            return _get_next_block(block_id + 1)
-        else:
-            raise cur
 
-    return cur
+def subtree_memo(name):
+    """Keeps the root of every subtree computed by the decorated range
+    function, at every size, in the response store under `name` keyed by
+    `(block_id, size)`. Overlapping proofs and later runs reuse them; a hit
+    saves `size` leaf fetches, counted in `metrics.LEAVES_SAVED`."""
+    def decorator(func):
+        hits = metrics.cache_tiers(name)
+        saved = metrics.LEAVES_SAVED.labels(method=name)
+
+        def wrapper(block_id, size):
+            cached = memo_load(name, (block_id, size))
+            if cached is not None:
+                hits['disk'].inc()
+                saved.inc(size)
+                return cached[0], decode(cached[1])
+
+            hits['network'].inc()
+            next_block, hash = func(block_id, size)
+            memo_store(name, (block_id, size), [next_block, encode(hash).decode()])
+            return next_block, hash
+
+        return wrapper
+
+    return decorator
 
 
+def leaves_saved():
+    return sum(child.value for _, child in metrics.LEAVES_SAVED.items())
+
+
+@subtree_memo('range_forward')
 def _get_range_forward(first_block, size):
     if size == 1:
         block = _get_next_block(first_block)
@@ -46,6 +76,7 @@ def get_range_forward(first_block, size):
     return _get_range_forward(first_block, size)
 
 
+@subtree_memo('range_backward')
 def _get_range_backward(last_block, size):
     if size == 1:
         block = get_block(last_block)
@@ -74,7 +105,22 @@ def get_range(block_left, block_right):
         return hashlib.sha256(left + right).digest()
 
 
-def check(receipt_id, base_light_client_head, verify_intermidates_values):
+def accumulated_range_forward(accumulator, first_block, size):
+    """`get_range_forward` over the leaves of a `MerkleAccumulator`."""
+    first = accumulator.ordinal_at_or_after(first_block)
+    return accumulator.height(first + size - 1) + 1, accumulator.range_hash(first, size)
+
+
+def accumulated_range_backward(accumulator, last_block, size):
+    """`get_range_backward` over the leaves of a `MerkleAccumulator`. Blocks
+    are identified by height instead of hash."""
+    first = accumulator.ordinal(last_block) - size
+    return accumulator.height(first), accumulator.range_hash(first, size)
+
+
+def check(receipt_id, base_light_client_head, verify_intermidates_values, accumulator=None):
+    """`accumulator` is an optional `MerkleAccumulator`; when it holds the
+    base block, intermediate values and the root are computed from it."""
 
     block_base = get_block(base_light_client_head)
     block_merkle_root = block_base.result.header.block_merkle_root
@@ -88,6 +134,13 @@ def check(receipt_id, base_light_client_head, verify_intermidates_values):
     left_block_id = height
     right_block_id = height + 1
     size = 1
+    saved = leaves_saved()
+
+    if accumulator is None or accumulator.ordinal(block_base.result.header.height) is None:
+        accumulator = None
+    else:
+        base = accumulator.ordinal(block_base.result.header.height)
+        print('Accumulated merkle root:', encode(accumulator.root(base)).decode())
 
     from pprint import pprint
     pprint(proof.result.block_proof)
@@ -99,7 +152,10 @@ def check(receipt_id, base_light_client_head, verify_intermidates_values):
             raw = value + inner
 
             if verify_intermidates_values:
-                right_block_id, hash = get_range_forward(right_block_id, size)
+                if accumulator is not None:
+                    right_block_id, hash = accumulated_range_forward(accumulator, right_block_id, size)
+                else:
+                    right_block_id, hash = get_range_forward(right_block_id, size)
                 hash = encode(hash).decode()
                 print(f"{step.hash} == {hash}: {step.hash == hash}")
 
@@ -111,7 +167,10 @@ def check(receipt_id, base_light_client_head, verify_intermidates_values):
             raw = inner + value
 
             if verify_intermidates_values:
-                left_block_id, hash = get_range_backward(left_block_id, size)
+                if accumulator is not None:
+                    left_block_id, hash = accumulated_range_backward(accumulator, left_block_id, size)
+                else:
+                    left_block_id, hash = get_range_backward(left_block_id, size)
                 hash = encode(hash).decode()
                 print(f"{step.hash} == {hash}: {step.hash == hash}")
 
@@ -127,41 +186,57 @@ def check(receipt_id, base_light_client_head, verify_intermidates_values):
     print('Found merkle root:   ', found_merkle_root)
     print('Expected merkle root:', block_merkle_root)
 
+    if verify_intermidates_values:
+        print('Leaf fetches avoided by cached subtrees:', leaves_saved() - saved)
+
     assert(found_merkle_root == block_merkle_root)
     print("Block proof correct")
 
 
-def find_epoch_change():
+def find_epoch_change(headers=None):
     block = 54544199
 
-    epoch_id = get_block(block).result.header.epoch_id
-
     lo = block
     hi = block + 10**6
 
-    while lo + 1 < hi:
-        mid = (lo + hi) // 2
-        cur_epoch_id = get_block(mid).result.header.epoch_id
+    if headers is not None and headers.has(lo) and headers.covers(lo, hi):
+        hi = headers.first_change(lo, hi, 'epoch_id') or hi
+        lo = hi - 1
+        while not headers.has(lo):
+            lo -= 1
+        print(lo, hi)
+        return
 
-        if epoch_id == cur_epoch_id:
-            lo = mid
-        else:
-            hi = mid
+    # Epochs indexed by `epochs.py build` are looked up instead of searched.
+    epoch = epochs.default().at(lo)
+    following = epochs.default().following(lo)
+    if epoch is not None and following is not None:
+        print(epoch[2], following[1])
+        return
+
+    # Skipped heights take the epoch of the block before them, so the change
+    # is found at the first block of the next epoch.
+    changes = change_points(epochs.epoch_at, lo, hi)
+    hi, _, _ = next(changes, (hi, None, None))
+    changes.close()
 
-    print(lo, hi)
+    print(nearest_block_at_or_before(hi - 1).height, hi)
 
 
 def download(height):
     from tqdm import tqdm
-    from itertools import count
 
-    block = get_block(height)
-    for _ in tqdm(count()):
-        block = get_block(block.result.header.prev_hash)
+    for _ in tqdm(iter_blocks(GENESIS_HEIGHT, height + 1, 'backward')):
+        pass
 
 
-def reconstruct(height, ordinal):
-    block = get_block(height)
+def reconstruct(height, ordinal, headers=None):
+    """`headers` is an optional `HeaderStore`; it is used instead of the RPC
+    when it covers the whole range."""
+    if headers is not None and headers.covers(GENESIS_HEIGHT, height + 1):
+        blocks = headers.iter_blocks(GENESIS_HEIGHT, height + 1, 'backward')
+    else:
+        blocks = iter_blocks(GENESIS_HEIGHT, height + 1, 'backward')
 
     stack = []
 
@@ -175,11 +250,10 @@ def reconstruct(height, ordinal):
         if right is None:
             return left
 
-        return encode(hashlib.sha256(decode(left) + decode(right)).digest()).decode()
+        return hashlib.sha256(left + right).digest()
 
-    for num in range(ordinal, 0, -1):
-        stack.append(block.result.header.hash)
-        block = get_block(block.result.header.prev_hash)
+    for num, header in zip(range(ordinal, 0, -1), blocks):
+        stack.append(header.hash)
 
         while num % 2 == 0:
             left = pop()
@@ -189,7 +263,7 @@ def reconstruct(height, ordinal):
             num //= 2
 
         if len(stack) == 1:
-            print(stack[0])
+            print(encode(stack[0]).decode())
 
 
 if __name__ == '__main__':
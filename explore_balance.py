@@ -1,89 +1,57 @@
 # a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near
 
-import requests
 import json
-import pickle
+from functools import partial
+
 import humanize
-from pprint import pprint
+from near_rpc import call_function, nearest_block_at_or_before, RpcError
+from near_rpc.search import batch_change_points, change_points
+from near_rpc.utils import persist_to_file
 
-url = "https://archival-rpc.mainnet.near.org/"
 USDC = "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48.factory.bridge.near"
 USDT = "dac17f958d2ee523a2206206994597c13d831ec7.factory.bridge.near"
 
 
-def persist_to_file(file_name):
-    def decorator(original_func):
-        try:
-            cache = pickle.load(open(file_name, 'rb'))
-        except:
-            cache = {}
-
-        def new_func(*args, **kwargs):
-            key = pickle.dumps([args, kwargs])
-            if key not in cache:
-                cache[key] = original_func(*args, **kwargs)
-                pickle.dump(cache, open(file_name, 'wb'))
-            return cache[key]
-
-        return new_func
-
-    return decorator
-
-
 @persist_to_file('.dat/balance.pickle')
 def get(token_id, block_id):
-    payload = json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "query",
-        "params": {
-            "request_type": "call_function",
-            "block_id": block_id,
-            "account_id": token_id,
-            "method_name": "ft_total_supply",
-            "args_base64": "e30="
-        }
-    })
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-    response = response.json()
+    # Goes through the shared near_rpc client, which backs off on 429/5xx.
+    response = call_function(token_id, 'ft_total_supply', b'{}', block_id)
 
     if 'error' in response and 'HANDLER_ERROR' == response['error']['name'] and 'UNKNOWN_BLOCK' == response['error']['cause']['name']:
-        return get(token_id, block_id - 1)
+        # Skipped height: the supply is the one at the block before it.
+        return get(token_id, nearest_block_at_or_before(block_id - 1).height)
 
     if 'error' in response and 'HANDLER_ERROR' == response['error']['name'] and 'UNKNOWN_ACCOUNT' == response['error']['cause']['name']:
         return 0
 
-    try:
-        return int(json.loads(bytes(response['result']['result'])))
-    except:
-        pprint(response)
-        exit(1)
+    if 'error' in response:
+        raise RpcError(response['error'])
+
+    return int(json.loads(bytes(response['result']['result'])))
+
 
+def find_blocks(token, lo, hi, supply_lo=None, supply_hi=None, checkpoint=None):
+    """Print every height where the supply of `token` changes, oldest
+    first. With `checkpoint`, an interrupted run resumes where it stopped."""
+    changes = change_points(lambda block_id: get(token, block_id), lo, hi,
+                            supply_lo, supply_hi, checkpoint=checkpoint)
 
-def find_blocks(token, lo, hi, supply_lo=None, supply_hi=None):
-    if supply_lo is None:
-        supply_lo = get(token, lo)
+    for hi, supply_lo, supply_hi in changes:
+        print_change(hi, supply_lo, supply_hi)
 
-    if supply_hi is None:
-        supply_hi = get(token, hi)
 
-    if supply_lo == supply_hi:
-        return
+def print_change(hi, supply_lo, supply_hi, token=None):
+    line = f'>> {hi} {humanize.intcomma(round(supply_lo / 1e6, 2)):>25} {humanize.intcomma(round(supply_hi / 1e6, 2)):>25} {humanize.intcomma(round((supply_hi - supply_lo) / 1e6, 0)):>25}'
+    print(line if token is None else f'{line} {token}', flush=True)
 
-    if lo + 1 == hi:
-        print(
-            f'>> {hi} {humanize.intcomma(round(supply_lo / 1e6, 2)):>25} {humanize.intcomma(round(supply_hi / 1e6, 2)):>25} {humanize.intcomma(round((supply_hi - supply_lo) / 1e6, 0)):>25}', flush=True)
 
-    else:
-        mid = (lo + hi) // 2
-        supply_mid = get(token, mid)
+def find_blocks_many(tokens, lo, hi, checkpoint=None):
+    """`find_blocks` for several tokens in a single pass: every round
+    queries all tokens at the same heights."""
+    targets = {token: partial(get, token) for token in tokens}
 
-        find_blocks(token, mid, hi, supply_mid, supply_hi)
-        find_blocks(token, lo, mid, supply_lo, supply_mid)
+    for token, hi, supply_lo, supply_hi in batch_change_points(targets, lo, hi, checkpoint=checkpoint):
+        print_change(hi, supply_lo, supply_hi, token)
 
 
 LO = 9820210
@@ -91,7 +59,7 @@ HI = 65852737
 
 
 def main():
-    find_blocks(USDT, LO, HI)
+    find_blocks(USDT, LO, HI, checkpoint=f'.dat/find_blocks-{USDT}.pickle')
 
 
 if __name__ == '__main__':
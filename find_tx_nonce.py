@@ -1,13 +1,10 @@
 """
 Find a transaction where the nonce increased on Aurora
 """
-import base64
-import dotmap
-import requests
-import json
+from functools import partial
 
-URL = "https://archival-rpc.mainnet.near.org/"
-GENESIS_HEIGHT = 9820210
+from near_rpc import GENESIS_HEIGHT, call_function, nearest_block_at_or_before, status
+from near_rpc.search import batch_change_points, change_points, checkpoint_range
 
 
 def normalize(address: str):
@@ -16,52 +13,24 @@ def normalize(address: str):
     return bytes.fromhex(address)
 
 
-headers = {
-    'Content-Type': 'application/json'
-}
-
-
-def rpc(paylaod):
-    response = requests.request("POST", URL, headers=headers, data=paylaod)
-    res = dotmap.DotMap(response.json())
-    return res
-
-
-def status():
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "status",
-        "params": []
-    }))
-
-
-def call_function(account_id: str, method: str, args: bytes, block_id: int):
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "query",
-        "params": {
-            "request_type": "call_function",
-            "block_id": block_id,
-            "account_id": account_id,
-            "method_name": method,
-            "args_base64": base64.b64encode(args).decode()
-        }
-    }))
-
-
 def get_nonce(address: str, block_id: int):
-    address = normalize(address)
-    res = call_function('aurora', 'get_nonce', address, block_id)
+    res = call_function('aurora', 'get_nonce', normalize(address), block_id)
+    if 'error' in res and res['error'].get('cause', {}).get('name') == 'UNKNOWN_BLOCK':
+        # Skipped height: the nonce is the one at the block before it.
+        return get_nonce(address, nearest_block_at_or_before(block_id - 1).height)
     if 'error' in res:
         return 0
     return res.result.result[-1]
 
 
-def find_blocks_for_txs(address: str):
-    lo = GENESIS_HEIGHT
-    hi = status().result.sync_info.latest_block_height
+def search_range(checkpoint):
+    # A resumed search keeps the head it started with.
+    return checkpoint_range(checkpoint) or \
+        (GENESIS_HEIGHT, status().result.sync_info.latest_block_height)
+
+
+def find_blocks_for_txs(address: str, checkpoint=None):
+    lo, hi = search_range(checkpoint)
 
     nonce_lo = get_nonce(address, lo)
     nonce_hi = get_nonce(address, hi)
@@ -74,28 +43,32 @@ def find_blocks_for_txs(address: str):
 
     heights = []
 
-    def search(lo, nonce_lo, hi, nonce_hi):
-        if nonce_lo == nonce_hi:
-            return
+    for height, _, _ in change_points(lambda block_id: get_nonce(address, block_id),
+                                      lo, hi, nonce_lo, nonce_hi, checkpoint=checkpoint):
+        print('>>', height)
+        heights.append(height)
+
+    return heights
+
 
-        if lo + 1 == hi:
-            print('>>', hi)
-            heights.append(hi)
-            return
+def find_blocks_for_many_txs(addresses, checkpoint=None):
+    """`find_blocks_for_txs` for several addresses in a single pass.
+    Returns the heights found for each address."""
+    lo, hi = search_range(checkpoint)
 
-        mid = (lo + hi) // 2
-        nonce_m = get_nonce(address, mid)
+    targets = {address: partial(get_nonce, address) for address in addresses}
+    heights = {address: [] for address in addresses}
 
-        search(lo, nonce_lo, mid, nonce_m)
-        search(mid, nonce_m, hi, nonce_hi)
+    for address, height, _, _ in batch_change_points(targets, lo, hi, checkpoint=checkpoint):
+        print('>>', address, height)
+        heights[address].append(height)
 
-    search(lo, nonce_lo, hi, nonce_hi)
     return heights
 
 
 def main():
     address = 'daa3172c59133b0860c050567b6a8322eea218eb'
-    H = find_blocks_for_txs(address)
+    H = find_blocks_for_txs(address, checkpoint=f'.dat/nonce-{address}.pickle')
     print(H)
 
 
@@ -0,0 +1,220 @@
+"""
+Asyncio counterpart of `near_rpc`. At most `concurrency` requests are in
+flight at any time. Results are stored in the same `.memo` cache used by the
+synchronous helpers, so both sides reuse each other's work.
+
+    async with AsyncClient(concurrency=64) as client:
+        blocks = await asyncio.gather(*(client.block(h) for h in heights))
+"""
+import asyncio
+import time
+import fastjson
+
+import aiohttp
+import dotmap
+
+import index
+import methods
+import metrics
+import policy
+import utils
+from batch import AsyncBatcher, BatchRejected, DEFAULT_BATCH_SIZE
+from client import DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF, DEFAULT_RETRIES, RETRY_STATUS
+from endpoints import from_env
+from limiter import Limiter, parse_retry_after
+
+URL = "https://archival-rpc.mainnet.near.org/"
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 60
+
+
+class AsyncClient:
+    def __init__(self, url=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 batch_size=DEFAULT_BATCH_SIZE, limiter=None):
+        """`url` defaults to the first archival endpoint of `NEAR_RPC_ENDPOINTS`
+        / `NEAR_RPC_ENDPOINTS_FILE`, as in `near_rpc.configure`, and then to
+        `URL`. Requests are throttled by a new `Limiter` unless one is given."""
+        if url is None:
+            archival = [e['url'] for e in from_env() or [] if e.get('archival', True)]
+            url = archival[0] if archival else URL
+        self.url = url
+        self.limiter = limiter if limiter is not None else Limiter()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.final_lock = asyncio.Lock()
+        self.session = None
+        self.batcher = AsyncBatcher(self.send, batch_size=batch_size)
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers={'Content-Type': 'application/json'},
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    async def _send_http(self, payload):
+        """Returns (status, retry_after, body)."""
+        async with self.semaphore:
+            if self.limiter is not None:
+                await self.limiter.acquire_async()
+            start = time.monotonic()
+            try:
+                async with self.session.post(self.url, data=payload) as response:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    body = await response.read() if response.status not in RETRY_STATUS else None
+                    status = response.status
+                    if status not in RETRY_STATUS:
+                        response.raise_for_status()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if self.limiter is not None:
+                    self.limiter.release(time.monotonic() - start, ok=False)
+                raise
+            except BaseException:
+                if self.limiter is not None:
+                    self.limiter.cancel()
+                raise
+
+            if self.limiter is not None:
+                self.limiter.release(time.monotonic() - start, ok=status not in RETRY_STATUS,
+                                     throttled=status == 429, retry_after=retry_after)
+            metrics.observe_http(self.url, time.monotonic() - start, status,
+                                 len(payload), len(body) if body is not None else 0)
+            return status, retry_after, body
+
+    async def post(self, payload):
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                status, retry_after, body = await self._send_http(payload)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last:
+                    raise
+                metrics.RETRIES.labels(endpoint=self.url, reason=type(e).__name__).inc()
+                await asyncio.sleep(self.delay(attempt))
+                continue
+
+            if status not in RETRY_STATUS:
+                return fastjson.loads(body)
+            if last:
+                raise aiohttp.ClientResponseError(None, (), status=status)
+            metrics.RETRIES.labels(endpoint=self.url, reason=str(status)).inc()
+
+            if retry_after is None or self.limiter is None:
+                await asyncio.sleep(self.delay(attempt) if retry_after is None else retry_after)
+
+    async def rpc(self, paylaod):
+        return dotmap.DotMap(await self.post(paylaod))
+
+    async def send(self, body):
+        try:
+            return await self.post(fastjson.dumps(body))
+        except aiohttp.ClientResponseError as e:
+            if isinstance(body, list) and 400 <= e.status < 500 and e.status != 429:
+                raise BatchRejected(e)
+            raise
+
+    async def request(self, payload):
+        start = time.monotonic()
+        response = await self.batcher.call(payload)
+        metrics.observe_request(payload['method'], time.monotonic() - start, response)
+        return dotmap.DotMap(response)
+
+    async def refresh_final_height(self, at_least):
+        """Ask the node for the final height when `policy.DEFAULT` needs it
+        to decide whether a call at `at_least` is permanent. One request at
+        a time; the others wait for it."""
+        if at_least is None or not policy.DEFAULT.stale(at_least):
+            return
+        async with self.final_lock:
+            if policy.DEFAULT.stale(at_least):
+                response = await self.request(methods.request("block", {"finality": "final"}))
+                policy.DEFAULT.refreshed(response.result.header.height)
+
+    def block(self, block_id):
+        return _block(self, block_id)
+
+    def chunk(self, chunk_id):
+        return _chunk(self, chunk_id)
+
+    def status(self):
+        return _status(self)
+
+    def call_function(self, account_id: str, method: str, args: bytes, block_id: int):
+        return _call_function(self, account_id, method, args, block_id)
+
+    def EXPERIMENTAL_light_client_proof(self, receipt_id: str, light_client_head: str, *receiver_id: str):
+        # receiver_id is only forwarded when given so the cache key matches
+        # the one produced by the sync helper.
+        return _light_client_proof(self, receipt_id, light_client_head, *receiver_id)
+
+    light_client_proof = EXPERIMENTAL_light_client_proof
+
+
+def shared_memo(name, resolve=None, canonical=None, observe=None):
+    """Cache in the response store under `name`, skipping the client
+    argument when building the key, so entries match those written by the
+    sync helpers. Only results that `policy` deems permanent are stored; the
+    final height is asked through the client when it is stale. `resolve`,
+    `canonical` and `observe` are the hooks of `Policy.cached`."""
+    def decorator(func):
+        hits = metrics.cache_tiers(name)
+
+        async def wrapper(client, *args):
+            await client.refresh_final_height(policy.DEFAULT.block_height(name, args))
+            if not policy.DEFAULT.permanent(name, args, refresh=False):
+                hits['network'].inc()
+                return await func(client, *args)
+
+            key_args = resolve(args) if resolve is not None else args
+            result = utils.memo_load(name, key_args)
+            if result is None and key_args != args:
+                result = utils.memo_load(name, args)
+            if result is not None:
+                hits['disk'].inc()
+                return result
+
+            hits['network'].inc()
+            result = await func(client, *args)
+            if not policy.transient(result):
+                utils.memo_store(name, canonical(args, result) if canonical is not None else args, result)
+                if observe is not None:
+                    observe(args, result)
+            return result
+        return wrapper
+    return decorator
+
+
+@shared_memo('block', index.resolve_block, index.canonical_block, index.observe_block)
+async def _block(client, block_id):
+    return await client.request(methods.block(block_id))
+
+
+@shared_memo('chunk')
+async def _chunk(client, chunk_id):
+    return await client.request(methods.chunk(chunk_id))
+
+
+@shared_memo('status')
+async def _status(client):
+    return await client.request(methods.status())
+
+
+@shared_memo('call_function')
+async def _call_function(client, account_id, method, args, block_id):
+    return await client.request(methods.call_function(account_id, method, args, block_id))
+
+
+@shared_memo('EXPERIMENTAL_light_client_proof')
+async def _light_client_proof(client, receipt_id, light_client_head, receiver_id='aurora'):
+    return await client.request(methods.EXPERIMENTAL_light_client_proof(receipt_id, light_client_head, receiver_id))
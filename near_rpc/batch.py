@@ -0,0 +1,175 @@
+"""
+Request layer that sits between the helpers and the HTTP client:
+
+- Identical requests that are in flight at the same time are merged: one
+  network call, many waiters.
+- Independent requests queued together are packed into one JSON-RPC batch
+  array of at most `batch_size` elements.
+
+If the endpoint does not accept batches (it answers with something other than
+an array of responses) batching is switched off and requests are sent one by
+one from then on.
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_LINGER = 0.002
+
+
+class BatchRejected(Exception):
+    pass
+
+
+def request_key(payload):
+    return json.dumps([payload['method'], payload['params']], sort_keys=True)
+
+
+def pack(payloads):
+    return [dict(payload, id=str(ix)) for ix, payload in enumerate(payloads)]
+
+
+def unpack(payloads, response):
+    if not isinstance(response, list):
+        raise BatchRejected(response)
+
+    by_id = {item.get('id'): item for item in response if isinstance(item, dict)}
+    ids = [str(ix) for ix in range(len(payloads))]
+    if any(ix not in by_id for ix in ids):
+        raise BatchRejected(response)
+
+    return [by_id[ix] for ix in ids]
+
+
+class Batcher:
+    """Thread safe. `send` takes a JSON-RPC body (an object or an array) and
+    returns the decoded response."""
+
+    def __init__(self, send, batch_size=DEFAULT_BATCH_SIZE, linger=DEFAULT_LINGER):
+        self.send = send
+        self.batch_size = batch_size
+        self.linger = linger
+        self.batching = batch_size > 1
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.pending = []
+
+    def call(self, payload):
+        key = request_key(payload)
+
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+                self.pending.append((key, payload, future))
+            else:
+                metrics.COALESCED.labels().inc()
+
+        if leader:
+            if self.linger and self.batching:
+                time.sleep(self.linger)
+            while not future.done():
+                batch = self.take()
+                if not batch:
+                    break
+                self.dispatch(batch)
+
+        return future.result()
+
+    def take(self):
+        with self.lock:
+            size = self.batch_size if self.batching else 1
+            batch = self.pending[:size]
+            del self.pending[:size]
+        return batch
+
+    def dispatch(self, batch):
+        try:
+            results = self.send_batch([payload for _, payload, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            with self.lock:
+                for key, _, _ in batch:
+                    self.inflight.pop(key, None)
+
+    def send_batch(self, payloads):
+        if len(payloads) > 1 and self.batching:
+            metrics.BATCHES.labels().inc()
+            try:
+                return unpack(payloads, self.send(pack(payloads)))
+            except BatchRejected:
+                self.batching = False
+        return [self.send(payload) for payload in payloads]
+
+
+class AsyncBatcher:
+    """Asyncio version of `Batcher`. `send` is a coroutine function."""
+
+    def __init__(self, send, batch_size=DEFAULT_BATCH_SIZE, linger=DEFAULT_LINGER):
+        self.send = send
+        self.batch_size = batch_size
+        self.linger = linger
+        self.batching = batch_size > 1
+        self.inflight = {}
+        self.pending = []
+
+    async def call(self, payload):
+        key = request_key(payload)
+
+        future = self.inflight.get(key)
+        if future is not None:
+            metrics.COALESCED.labels().inc()
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[key] = future
+            self.pending.append((key, payload, future))
+
+            if self.linger and self.batching:
+                await asyncio.sleep(self.linger)
+            while not future.done():
+                batch = self.take()
+                if not batch:
+                    break
+                await self.dispatch(batch)
+
+        return await future
+
+    def take(self):
+        size = self.batch_size if self.batching else 1
+        batch = self.pending[:size]
+        del self.pending[:size]
+        return batch
+
+    async def dispatch(self, batch):
+        try:
+            results = await self.send_batch([payload for _, payload, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            for key, _, _ in batch:
+                self.inflight.pop(key, None)
+
+    async def send_batch(self, payloads):
+        if len(payloads) > 1 and self.batching:
+            metrics.BATCHES.labels().inc()
+            try:
+                return unpack(payloads, await self.send(pack(payloads)))
+            except BatchRejected:
+                self.batching = False
+        return await asyncio.gather(*(self.send(payload) for payload in payloads))
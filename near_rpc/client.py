@@ -0,0 +1,109 @@
+"""
+Pooled, keep-alive HTTP transport used by every helper in `near_rpc`.
+
+A single `requests.Session` is reused across calls so the TCP and TLS
+handshakes with the archival node are paid once per connection instead of
+once per request.
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from limiter import parse_retry_after
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class Client:
+    def __init__(self, url, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 limiter=None):
+        self.url = url
+        self.pool_size = pool_size
+        self.limiter = limiter
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    def send(self, payload):
+        start = time.monotonic()
+        response = self.send_limited(payload)
+        metrics.observe_http(self.url, time.monotonic() - start, response.status_code,
+                             len(payload), len(response.content))
+        return response
+
+    def send_limited(self, payload):
+        if self.limiter is None:
+            return self.session.post(self.url, data=payload, timeout=self.timeout)
+
+        self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.post(
+                self.url, data=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            self.limiter.release(time.monotonic() - start, ok=False)
+            raise
+        except BaseException:
+            self.limiter.cancel()
+            raise
+
+        self.limiter.release(
+            time.monotonic() - start,
+            ok=response.status_code not in RETRY_STATUS,
+            throttled=response.status_code == 429,
+            retry_after=parse_retry_after(response.headers.get('Retry-After')))
+        return response
+
+    def post(self, payload):
+        """Send `payload` and return the raw response, retrying transient
+        failures (connection errors, timeouts, 429 and 5xx) with exponential
+        backoff, or after `Retry-After` when the server sends it."""
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.send(payload)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise
+                metrics.RETRIES.labels(endpoint=self.url, reason=type(e).__name__).inc()
+                time.sleep(self.delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS and not last:
+                metrics.RETRIES.labels(endpoint=self.url, reason=str(response.status_code)).inc()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is None or self.limiter is None:
+                    time.sleep(self.delay(attempt) if retry_after is None else retry_after)
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,232 @@
+"""
+Pool of RPC endpoints with latency based routing, hedging and failover.
+
+Endpoints are read from `NEAR_RPC_ENDPOINTS`, a comma separated list of
+urls where archival nodes are prefixed with `archival:`
+
+    NEAR_RPC_ENDPOINTS=archival:https://archival-rpc.mainnet.near.org/,https://rpc.mainnet.near.org/
+
+or from the JSON file pointed by `NEAR_RPC_ENDPOINTS_FILE`:
+
+    [{"url": "https://archival-rpc.mainnet.near.org/", "archival": true},
+     {"url": "https://rpc.mainnet.near.org/", "archival": false}]
+
+Each request goes to the healthy endpoint with the lowest recent latency
+among those that can serve it (only archival nodes for old blocks). If it
+hasn't answered after the `HEDGE_PERCENTILE` latency of that endpoint, the
+same request is sent to the next best endpoint and the first answer wins.
+Failed endpoints are put on a cooldown and the request is retried on the
+next one. Each endpoint is tried once per round: the pool, not the
+endpoint's `Client`, retries with backoff once every endpoint has failed, so
+a failing node doesn't hold a request through its own retries.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from client import Client, DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF, DEFAULT_RETRIES, RETRY_STATUS
+from limiter import Limiter, parse_retry_after
+import metrics
+
+HEDGE_PERCENTILE = 0.95
+# Don't hedge until this many latencies have been observed on an endpoint.
+HEDGE_MIN_SAMPLES = 20
+WINDOW = 200
+COOLDOWN = 10
+MAX_COOLDOWN = 300
+EWMA = 0.2
+
+
+class Endpoint:
+    def __init__(self, url, archival=True, **kwargs):
+        self.url = url
+        self.archival = archival
+        kwargs.setdefault('limiter', Limiter())
+        # Retries are done by the pool, which can fail over meanwhile.
+        self.client = Client(url, retries=0, **kwargs)
+        self.latencies = deque(maxlen=WINDOW)
+        self.latency = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.lock = threading.Lock()
+
+    def available(self):
+        return time.monotonic() >= self.down_until
+
+    def score(self):
+        # Endpoints without measurements are tried first.
+        return self.latency if self.latency is not None else 0.0
+
+    def hedge_after(self):
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))]
+
+    def success(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.latency = latency if self.latency is None else \
+                (1 - EWMA) * self.latency + EWMA * latency
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            cooldown = min(MAX_COOLDOWN, COOLDOWN * 2 ** (self.failures - 1))
+            self.down_until = time.monotonic() + cooldown
+
+    def post(self, payload):
+        start = time.monotonic()
+        try:
+            response = self.client.post(payload)
+        except (requests.ConnectionError, requests.Timeout):
+            self.failure()
+            raise
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in RETRY_STATUS:
+                self.failure()
+            raise
+        self.success(time.monotonic() - start)
+        return response
+
+    def state(self):
+        return dict(
+            url=self.url,
+            archival=self.archival,
+            latency=self.latency,
+            hedge_after=self.hedge_after(),
+            failures=self.failures,
+            down_for=max(0.0, self.down_until - time.monotonic()),
+            limiter=self.client.limiter.state() if self.client.limiter else None,
+        )
+
+    def close(self):
+        self.client.close()
+
+
+def parse(value):
+    endpoints = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        archival = item.startswith('archival:')
+        if archival:
+            item = item[len('archival:'):]
+        endpoints.append(dict(url=item, archival=archival))
+    return endpoints
+
+
+def from_env():
+    """Endpoint descriptions from the environment, or None if unset."""
+    if os.environ.get('NEAR_RPC_ENDPOINTS'):
+        return parse(os.environ['NEAR_RPC_ENDPOINTS'])
+    if os.environ.get('NEAR_RPC_ENDPOINTS_FILE'):
+        with open(os.environ['NEAR_RPC_ENDPOINTS_FILE']) as f:
+            return json.load(f)
+    return None
+
+
+class EndpointPool:
+    def __init__(self, endpoints, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, **kwargs):
+        """`endpoints` is a list of dicts with `url` and `archival`. Other
+        keyword arguments are passed to every `Client`."""
+        self.endpoints = [Endpoint(e['url'], e.get('archival', True), **kwargs)
+                          for e in endpoints]
+        if not any(e.archival for e in self.endpoints):
+            raise ValueError('At least one archival endpoint is required')
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        workers = sum(e.client.pool_size for e in self.endpoints)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def ranked(self, archival):
+        candidates = [e for e in self.endpoints if e.archival or not archival]
+        healthy = [e for e in candidates if e.available()]
+        # If everything is cooling down, still try the one that is back first.
+        if not healthy:
+            healthy = sorted(candidates, key=lambda e: e.down_until)[:1]
+        return sorted(healthy, key=Endpoint.score)
+
+    def delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    def post(self, payload, archival=True):
+        """Send `payload` to the best endpoint that can serve it, hedging to
+        the second best after its latency percentile, and failing over to
+        the rest on errors. When all of them fail, try again after a
+        backoff, or after `Retry-After` when the last one sent it."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.attempt(payload, archival)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    raise
+                reason = str(e.response.status_code)
+                retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                reason, retry_after = type(e).__name__, None
+
+            metrics.RETRIES.labels(endpoint='pool', reason=reason).inc()
+            # The limiters already hold back endpoints that sent Retry-After.
+            if retry_after is None:
+                time.sleep(self.delay(attempt))
+
+    def attempt(self, payload, archival):
+        """One round: every endpoint is tried at most once. Raises the last
+        transient error if none of them answered."""
+        order = self.ranked(archival)
+        if len(order) == 1:
+            return order[0].post(payload)
+
+        pending = {}
+        error = None
+        while order or pending:
+            if not pending:
+                endpoint = order.pop(0)
+                pending[self.executor.submit(endpoint.post, payload)] = endpoint
+
+            timeout = None
+            if len(pending) == 1 and order:
+                timeout = next(iter(pending.values())).hedge_after()
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Hedge: the primary is slower than usual.
+                endpoint = order.pop(0)
+                metrics.HEDGES.labels(endpoint=endpoint.url).inc()
+                pending[self.executor.submit(endpoint.post, payload)] = endpoint
+                continue
+
+            for future in done:
+                del pending[future]
+                try:
+                    return future.result()
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code not in RETRY_STATUS:
+                        raise
+                    error = e
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+
+        raise error
+
+    def state(self):
+        return [e.state() for e in self.endpoints]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for e in self.endpoints:
+            e.close()
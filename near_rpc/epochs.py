@@ -0,0 +1,186 @@
+"""
+Persistent table of epochs: epoch_id -> (first height, last height,
+next_bp_hash), in the same SQLite file as the response cache.
+
+Epochs are almost always `EPOCH_LENGTH` heights long, so `build` predicts
+where the next epoch starts from where the current one did, checks a small
+window around the guess, and only bisects when the guess misses. Walking
+every epoch since genesis costs a handful of requests per epoch.
+
+    python epochs.py build [end]
+    python epochs.py show [height]
+
+Only finished epochs are stored.
+"""
+import sys
+import threading
+
+import store
+from search import change_points
+
+EPOCH_LENGTH = 43200
+# Heights checked on each side of the predicted boundary.
+WINDOW = 8
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS epochs (
+        epoch_id TEXT PRIMARY KEY,
+        first INTEGER NOT NULL UNIQUE,
+        last INTEGER NOT NULL,
+        next_bp_hash TEXT
+    )
+    ''',
+]
+
+
+class EpochIndex:
+    def __init__(self, path=store.DEFAULT_PATH):
+        self.path = path
+        self.local = threading.local()
+
+        conn = self.connection()
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = store.connect(self.path)
+        return conn
+
+    def add(self, epoch_id, first, last, next_bp_hash):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO epochs (epoch_id, first, last, next_bp_hash) VALUES (?, ?, ?, ?)',
+            (epoch_id, first, last, next_bp_hash))
+
+    def get(self, epoch_id):
+        """`(first, last, next_bp_hash)` of `epoch_id`, or None."""
+        return self.connection().execute(
+            'SELECT first, last, next_bp_hash FROM epochs WHERE epoch_id = ?', (epoch_id,)).fetchone()
+
+    def at(self, height):
+        """`(epoch_id, first, last, next_bp_hash)` of the epoch that holds
+        `height`, or None if it isn't indexed."""
+        row = self.connection().execute(
+            'SELECT epoch_id, first, last, next_bp_hash FROM epochs WHERE first <= ? '
+            'ORDER BY first DESC LIMIT 1', (height,)).fetchone()
+        return row if row is not None and height <= row[2] else None
+
+    def following(self, height):
+        """First indexed epoch that starts after `height`, or None."""
+        return self.connection().execute(
+            'SELECT epoch_id, first, last, next_bp_hash FROM epochs WHERE first > ? '
+            'ORDER BY first LIMIT 1', (height,)).fetchone()
+
+    def latest(self):
+        return self.connection().execute(
+            'SELECT epoch_id, first, last, next_bp_hash FROM epochs ORDER BY first DESC LIMIT 1').fetchone()
+
+    def all(self):
+        return self.connection().execute(
+            'SELECT epoch_id, first, last, next_bp_hash FROM epochs ORDER BY first').fetchall()
+
+    def close(self):
+        # Rows are written as they are added; only the connection is left.
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+default = store.Shared(EpochIndex)
+
+
+def epoch_at(height):
+    from near_rpc import nearest_block_at_or_before
+
+    # Skipped heights belong to the epoch of the block before them.
+    return nearest_block_at_or_before(height).epoch_id
+
+
+def next_boundary(first, epoch_id, length, end, window=WINDOW):
+    """Height of the first block after `first` whose epoch isn't
+    `epoch_id`, or None if there is none before `end`."""
+    last = end - 1
+    if epoch_at(last) == epoch_id:
+        return None
+
+    lo, hi = max(first, first + length - window), min(first + length + window, last)
+    value_lo, value_hi = epoch_at(lo), epoch_at(hi)
+    if value_lo != epoch_id:
+        # Shorter than predicted.
+        lo, value_lo, hi, value_hi = first, epoch_id, lo, value_lo
+    while value_hi == epoch_id:
+        # Longer than predicted.
+        lo, value_lo = hi, value_hi
+        hi = min(hi + length, last)
+        value_hi = epoch_at(hi)
+
+    # Small ranges are bisected one probe at a time, which needs the fewest
+    # requests; a miss is searched with wider rounds.
+    k = 2 if hi - lo <= 4 * window else 8
+    changes = change_points(epoch_at, lo, hi, value_lo, value_hi, k=k)
+    height, _, _ = next(changes)
+    changes.close()
+    return height
+
+
+def build(index=None, start=None, end=None, length=EPOCH_LENGTH, window=WINDOW):
+    """Index every finished epoch from the one holding `start` (genesis by
+    default, or where the last run stopped) up to `end` (the final height by
+    default). Returns the number of epochs added."""
+    from near_rpc import (GENESIS_HEIGHT, BlockHeader, nearest_block_at_or_after,
+                          nearest_block_at_or_before, policy)
+
+    index = index or default()
+    if end is None:
+        end = policy.final_height() + 1
+
+    latest = index.latest()
+    if start is None and latest is not None:
+        start = latest[2] + 1
+    elif start is None:
+        start = GENESIS_HEIGHT
+
+    header = nearest_block_at_or_after(start, end)
+    if header is None:
+        return 0
+    if start != GENESIS_HEIGHT and (latest is None or start != latest[2] + 1):
+        # Somewhere inside an epoch: find where it started.
+        changes = change_points(epoch_at, GENESIS_HEIGHT, header.height, reverse=True)
+        height, _, _ = next(changes, (GENESIS_HEIGHT, None, None))
+        changes.close()
+        header = nearest_block_at_or_after(height, end)
+
+    added = 0
+    while True:
+        boundary = next_boundary(header.height, header.epoch_id, length, end, window)
+        if boundary is None:
+            return added
+
+        last = nearest_block_at_or_before(boundary - 1)
+        index.add(BlockHeader.encode_hash(header.epoch_id), header.height, last.height,
+                  BlockHeader.encode_hash(header.next_bp_hash) if header.next_bp_hash else None)
+        added += 1
+
+        length = boundary - header.height
+        header = nearest_block_at_or_after(boundary, end)
+
+
+def main(argv):
+    if not argv or argv[0] not in ('build', 'show'):
+        print(__doc__)
+        exit(1)
+
+    if argv[0] == 'build':
+        print(f'Added {build(end=int(argv[1]) if len(argv) > 1 else None)} epochs')
+    elif len(argv) > 1:
+        print(default().at(int(argv[1])))
+    else:
+        for epoch_id, first, last, next_bp_hash in default().all():
+            print(f'{epoch_id:<46} {first:>10} {last:>10} {next_bp_hash}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
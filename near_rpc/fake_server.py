@@ -0,0 +1,224 @@
+"""
+Local stand-in for the NEAR JSON-RPC subset used by the scripts (`block`,
+`chunk`, `status`, `query/call_function`, `EXPERIMENTAL_light_client_proof`),
+for offline benchmarks and regression tests.
+
+Responses come from recorded fixtures and/or an existing response cache:
+
+- a fixtures folder laid out like the old `.memo` tree
+  (`<folder>/<method>/<args joined by '-'>`, one JSON response per file),
+- a `.memo.sqlite` store (see `store.py`).
+
+Requests without a recorded answer get UNKNOWN_BLOCK. Latency, errors and
+extra UNKNOWN_BLOCK gaps can be injected:
+
+    python fake_server.py --memo .memo.sqlite --port 3030 \\
+        --latency 0.05 --jitter 0.02 --error-rate 0.01 --missing-rate 0.001
+
+Point the clients to it with
+
+    NEAR_RPC_ENDPOINTS=archival:http://127.0.0.1:3030/
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fastjson
+import index
+import store
+import utils
+
+
+def unknown_block(request_id):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "name": "HANDLER_ERROR",
+            "cause": {"name": "UNKNOWN_BLOCK", "info": {}},
+            "code": -32000,
+            "message": "Server error",
+            "data": "DB Not Found Error"
+        }
+    }
+
+
+def batch_unsupported():
+    return {
+        "jsonrpc": "2.0",
+        "id": None,
+        "error": {"code": -32600, "message": "Batch requests are not supported"},
+    }
+
+
+def cache_args(method, params):
+    """Name and arguments used by the near_rpc helpers to cache a request,
+    or None if it can't be served."""
+    if method == 'block' and isinstance(params, dict) and 'block_id' in params:
+        return 'block', (params['block_id'],)
+    if method == 'block' and isinstance(params, dict) and 'finality' in params:
+        return 'block', (params['finality'],)
+    if method == 'chunk' and isinstance(params, dict) and 'chunk_id' in params:
+        return 'chunk', (params['chunk_id'],)
+    if method == 'status':
+        return 'status', ()
+    if method == 'query' and isinstance(params, dict) and params.get('request_type') == 'call_function':
+        args = base64.b64decode(params.get('args_base64', ''))
+        return 'call_function', (params['account_id'], params['method_name'], args, params['block_id'])
+    if method == 'EXPERIMENTAL_light_client_proof' and isinstance(params, dict):
+        args = (params['receipt_id'], params['light_client_head'])
+        if params.get('receiver_id', 'aurora') != 'aurora':
+            args += (params['receiver_id'],)
+        return 'EXPERIMENTAL_light_client_proof', args
+    return None
+
+
+class Fixtures:
+    def __init__(self, folder=None, memo=None, final_height=None):
+        """`final_height` is the block served for `finality` queries when
+        there is no `block/final` fixture."""
+        self.folder = folder
+        self.memo = store.Store(memo) if memo else None
+        # The sync client stores blocks under their hash only.
+        self.index = index.HeaderIndex(memo) if memo else None
+        self.final_height = final_height
+
+    def lookup(self, name, args):
+        if name == 'block' and args[0] in ('final', 'optimistic') and self.final_height is not None:
+            found = self.lookup_key(name, utils.memo_key(args))
+            return found if found is not None else self.lookup(name, (self.final_height,))
+        found = self.lookup_key(name, utils.memo_key(args))
+        if found is None and name == 'block' and self.index is not None and isinstance(args[0], int):
+            hash = self.index.hash_at(args[0])
+            if hash is not None:
+                found = self.lookup_key(name, utils.memo_key((hash,)))
+        return found
+
+    def lookup_key(self, name, key):
+        if self.folder is not None:
+            path = os.path.join(self.folder, name, key)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return fastjson.loads(f.read())
+        if self.memo is not None:
+            return self.memo.get(name, key)
+        return None
+
+
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, missing_rate=0.0, seed=None, batches=True):
+        """With `batches=False` batch arrays are answered with a single
+        error object, as by nodes and proxies that don't support them."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.missing_rate = missing_rate
+        self.batches = batches
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def roll(self):
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            return delay, self.random.random() < self.error_rate, self.random.random() < self.missing_rate
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fixtures = None
+    faults = None
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, request):
+        name_args = cache_args(request.get('method'), request.get('params'))
+        response = None
+        if name_args is not None:
+            response = self.fixtures.lookup(*name_args)
+        if response is None:
+            return unknown_block(request.get('id'))
+        return dict(response, id=request.get('id'))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        delay, error, missing = self.faults.roll()
+        time.sleep(delay)
+
+        if error:
+            with self.faults.lock:
+                self.faults.errors += 1
+            self.reply(503, b'{"error": "injected"}')
+            return
+
+        request = fastjson.loads(body)
+        if isinstance(request, list) and not self.faults.batches:
+            responses = batch_unsupported()
+        elif isinstance(request, list):
+            responses = [unknown_block(r.get('id')) if missing else self.answer(r)
+                         for r in request]
+        else:
+            responses = unknown_block(request.get('id')) if missing else self.answer(request)
+        self.reply(200, fastjson.dumps(responses))
+
+    def reply(self, code, data):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(fixtures, faults=None, host='127.0.0.1', port=0):
+    """Start the server in a background thread. Returns the server; its url
+    is `http://{host}:{server.server_port}/`."""
+    handler = type('FixtureHandler', (Handler,), dict(
+        fixtures=fixtures, faults=faults or Faults()))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='Folder with recorded responses (.memo layout)')
+    parser.add_argument('--memo', help='SQLite response cache to serve from')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3030)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform +/- seconds around --latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--missing-rate', type=float, default=0.0, help='Fraction of requests answered with UNKNOWN_BLOCK')
+    parser.add_argument('--no-batches', action='store_true', help='Reject JSON-RPC batch arrays')
+    parser.add_argument('--final-height', type=int, help='Block served for finality queries')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.fixtures is None and args.memo is None:
+        parser.error('Pass --fixtures and/or --memo')
+
+    server = serve(Fixtures(args.fixtures, args.memo, args.final_height),
+                   Faults(args.latency, args.jitter, args.error_rate, args.missing_rate, args.seed,
+                          not args.no_batches),
+                   args.host, args.port)
+    print(f'Serving on http://{args.host}:{server.server_port}/', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        faults = server.RequestHandlerClass.faults
+        print(json.dumps(dict(requests=faults.requests, errors=faults.errors)))
+
+
+if __name__ == '__main__':
+    main()
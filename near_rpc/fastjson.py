@@ -0,0 +1,26 @@
+"""
+JSON encode/decode using orjson when it is installed, the standard library
+otherwise. `dumps` always returns bytes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(value):
+        return orjson.dumps(value)
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(value):
+        return json.dumps(value, separators=(',', ':')).encode()
@@ -0,0 +1,89 @@
+"""
+Compact block header records for hot paths.
+
+A `BlockHeader` keeps only the fields the scripts read, with hashes already
+base58 decoded to raw 32 bytes. It is a few hundred bytes instead of the
+tree of DotMaps built for a full block response. The full response is only
+loaded again when `full()` is called.
+"""
+import base58 as b58
+
+
+class RpcError(Exception):
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+    @property
+    def name(self):
+        return self.error.get('cause', {}).get('name') or self.error.get('name')
+
+
+class UnknownBlock(RpcError):
+    pass
+
+
+def raise_for_error(response):
+    if 'error' in response:
+        error = response['error']
+        if error.get('cause', {}).get('name') == 'UNKNOWN_BLOCK':
+            raise UnknownBlock(error)
+        raise RpcError(error)
+
+
+class BlockHeader:
+    __slots__ = ('height', 'hash', 'prev_hash', 'epoch_id',
+                 'next_epoch_id', 'block_merkle_root', 'timestamp', 'next_bp_hash')
+
+    # Set by `near_rpc` to its `block` helper.
+    loader = None
+
+    def __init__(self, height, hash, prev_hash, epoch_id, next_epoch_id, block_merkle_root, timestamp,
+                 next_bp_hash=None):
+        self.height = height
+        self.hash = hash
+        self.prev_hash = prev_hash
+        self.epoch_id = epoch_id
+        self.next_epoch_id = next_epoch_id
+        self.block_merkle_root = block_merkle_root
+        self.timestamp = timestamp
+        self.next_bp_hash = next_bp_hash
+
+    @classmethod
+    def from_response(cls, response):
+        raise_for_error(response)
+        header = response['result']['header']
+        return cls(
+            height=header['height'],
+            hash=b58.b58decode(header['hash']),
+            prev_hash=b58.b58decode(header['prev_hash']),
+            epoch_id=b58.b58decode(header['epoch_id']),
+            next_epoch_id=b58.b58decode(header['next_epoch_id']),
+            block_merkle_root=b58.b58decode(header['block_merkle_root']),
+            timestamp=int(header['timestamp']),
+            next_bp_hash=b58.b58decode(header['next_bp_hash']) if 'next_bp_hash' in header else None,
+        )
+
+    @staticmethod
+    def encode_hash(value):
+        return b58.b58encode(value).decode()
+
+    @property
+    def hash_b58(self):
+        return b58.b58encode(self.hash).decode()
+
+    @property
+    def prev_hash_b58(self):
+        return b58.b58encode(self.prev_hash).decode()
+
+    def full(self):
+        return BlockHeader.loader(self.hash_b58)
+
+    def __eq__(self, other):
+        return isinstance(other, BlockHeader) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+    def __repr__(self):
+        return f'BlockHeader(height={self.height}, hash={self.hash_b58})'
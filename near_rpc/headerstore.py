@@ -0,0 +1,249 @@
+"""
+Memory mapped store of fixed width block header records, for full chain
+scans (merkle reconstruction, epoch analysis, ...).
+
+Record `height - genesis` of `<path>.bin` holds
+
+    hash (32) | prev_hash (32) | epoch_id (32) | block_merkle_root (32) | timestamp (u64 LE)
+
+and two bitmaps, `<path>.present` and `<path>.missing`, tell which heights
+have a record and which are known to have no block. Any height is read in
+O(1), and `columns()` returns NumPy views over the whole file.
+
+Fill it with
+
+    python headerstore.py fill <start> <end> [path]
+"""
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from header import BlockHeader
+
+RECORD = struct.Struct('<32s32s32s32sQ')
+GROW = 1 << 16
+
+if np is not None:
+    DTYPE = np.dtype([
+        ('hash', 'S32'),
+        ('prev_hash', 'S32'),
+        ('epoch_id', 'S32'),
+        ('block_merkle_root', 'S32'),
+        ('timestamp', '<u8'),
+    ])
+
+
+class MappedFile:
+    """A file mapped in memory that grows in steps of `step` bytes."""
+
+    def __init__(self, path, step, writable):
+        self.path = path
+        self.step = step
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            open(path, 'wb').close()
+        self.file = open(path, 'r+b' if writable else 'rb')
+        self.map = None
+        self.remap()
+
+    def remap(self):
+        if self.map is not None:
+            self.map.close()
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ) \
+            if size else None
+
+    def size(self):
+        return len(self.map) if self.map is not None else 0
+
+    def ensure(self, size):
+        if size <= self.size():
+            return
+        new_size = (size + self.step - 1) // self.step * self.step
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        self.file.truncate(new_size)
+        self.remap()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        self.file.close()
+
+
+class HeaderStore:
+    def __init__(self, path='.headers', genesis=None, writable=True):
+        if genesis is None:
+            from near_rpc import GENESIS_HEIGHT
+            genesis = GENESIS_HEIGHT
+        self.genesis = genesis
+        self.records = MappedFile(path + '.bin', GROW * RECORD.size, writable)
+        self.present = MappedFile(path + '.present', GROW // 8, writable)
+        self.missing = MappedFile(path + '.missing', GROW // 8, writable)
+
+    def ordinal(self, height):
+        if height < self.genesis:
+            raise IndexError(f'Height {height} is before genesis')
+        return height - self.genesis
+
+    def _bit(self, bitmap, height):
+        ix = self.ordinal(height)
+        if ix // 8 >= bitmap.size():
+            return False
+        return bool(bitmap.map[ix // 8] >> (ix % 8) & 1)
+
+    def _set_bit(self, bitmap, height):
+        ix = self.ordinal(height)
+        bitmap.ensure(ix // 8 + 1)
+        bitmap.map[ix // 8] |= 1 << (ix % 8)
+
+    def has(self, height):
+        return self._bit(self.present, height)
+
+    def is_missing(self, height):
+        return self._bit(self.missing, height)
+
+    def known(self, height):
+        return self.has(height) or self.is_missing(height)
+
+    def put(self, header):
+        ix = self.ordinal(header.height)
+        self.records.ensure((ix + 1) * RECORD.size)
+        RECORD.pack_into(self.records.map, ix * RECORD.size, header.hash, header.prev_hash,
+                         header.epoch_id, header.block_merkle_root, header.timestamp)
+        self._set_bit(self.present, header.height)
+
+    def put_missing(self, height):
+        self._set_bit(self.missing, height)
+
+    def get(self, height):
+        """The header at `height`, or None if it isn't in the store. Headers
+        read from the store have no `next_epoch_id` nor `next_bp_hash`."""
+        if not self.has(height):
+            return None
+        hash, prev_hash, epoch_id, block_merkle_root, timestamp = RECORD.unpack_from(
+            self.records.map, self.ordinal(height) * RECORD.size)
+        return BlockHeader(height, hash, prev_hash, epoch_id, None, block_merkle_root, timestamp)
+
+    def _bits(self, bitmap, start, end):
+        lo, hi = self.ordinal(start), self.ordinal(end)
+        bits = np.zeros(hi - lo, dtype=bool)
+        available = min(hi, bitmap.size() * 8)
+        if available > lo:
+            raw = np.frombuffer(bitmap.map, dtype=np.uint8)
+            unpacked = np.unpackbits(raw[lo // 8:(available + 7) // 8], bitorder='little')
+            bits[:available - lo] = unpacked[lo % 8:lo % 8 + available - lo]
+        return bits
+
+    def covers(self, start, end):
+        """Whether every height in [start, end) is either stored or known to
+        be missing."""
+        if np is None:
+            return all(self.known(height) for height in range(start, end))
+        return bool(np.all(self._bits(self.present, start, end) | self._bits(self.missing, start, end)))
+
+    def first_change(self, start, end, field):
+        """First height in (start, end) whose `field` differs from the one of
+        the block at `start`, or None. The range must be covered."""
+        if np is None:
+            base = getattr(self.get(start), field)
+            for header in self.iter_blocks(start + 1, end):
+                if getattr(header, field) != base:
+                    return header.height
+            return None
+
+        records, _ = self.columns()
+        lo, hi = self.ordinal(start), self.ordinal(end)
+        present = self._bits(self.present, start, end)
+        column = records[field][lo:hi]
+        changed = (column != column[0]) & present[:len(column)]
+        if not changed.any():
+            return None
+        return start + int(np.argmax(changed))
+
+    def iter_blocks(self, start, end, direction='forward'):
+        """Same as `near_rpc.iter_blocks`, reading only from the store."""
+        heights = range(start, end) if direction == 'forward' else range(end - 1, start - 1, -1)
+        for height in heights:
+            header = self.get(height)
+            if header is not None:
+                yield header
+
+    def columns(self):
+        """Structured NumPy view over all records (index = height - genesis)
+        and a boolean array telling which of them are present. The view
+        points into the mapped file: drop it before writing to the store."""
+        if np is None:
+            raise RuntimeError('numpy is required for columns()')
+        count = self.records.size() // RECORD.size
+        records = np.frombuffer(self.records.map, dtype=DTYPE, count=count) if count else \
+            np.zeros(0, dtype=DTYPE)
+        bits = np.frombuffer(self.present.map, dtype=np.uint8) if self.present.size() else \
+            np.zeros(0, dtype=np.uint8)
+        present = np.unpackbits(bits, bitorder='little')[:count].astype(bool)
+        present = np.pad(present, (0, count - len(present)))
+        return records, present
+
+    def flush(self):
+        for f in (self.records, self.present, self.missing):
+            if f.map is not None:
+                f.map.flush()
+
+    def close(self):
+        for f in (self.records, self.present, self.missing):
+            f.close()
+
+
+def fill(headers, start, end, window=64):
+    """Download every header in [start, end) that isn't in `headers` yet.
+    Stops at the final height, so that no height is marked as missing
+    before it is final."""
+    from near_rpc import iter_blocks, policy
+
+    end = min(end, policy.final_height() + 1)
+
+    height = start
+    while height < end:
+        # Skip the prefix that is already stored.
+        while height < end and headers.known(height):
+            height += 1
+        if height == end:
+            break
+        stop = height
+        while stop < end and not headers.known(stop):
+            stop += 1
+
+        expected = height
+        for header in iter_blocks(height, stop, 'forward', window):
+            for missing in range(expected, header.height):
+                headers.put_missing(missing)
+            headers.put(header)
+            expected = header.height + 1
+        for missing in range(expected, stop):
+            headers.put_missing(missing)
+        height = stop
+
+    headers.flush()
+
+
+def main(argv):
+    if len(argv) < 3 or argv[0] != 'fill':
+        print(__doc__)
+        exit(1)
+
+    headers = HeaderStore(argv[3] if len(argv) > 3 else '.headers')
+    fill(headers, int(argv[1]), int(argv[2]))
+    headers.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
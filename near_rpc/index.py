@@ -0,0 +1,167 @@
+"""
+Persistent block header index: height -> hash, hash -> height,
+hash -> prev_hash, plus the set of heights known to have no block.
+
+It is filled from every final block seen by `near_rpc.block`, and lets a
+block fetched by height be found later by hash (and the other way around)
+without downloading it again. Lives in the same SQLite file as the response
+cache.
+"""
+import threading
+
+import policy
+import store
+
+FLUSH_EVERY = 1000
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS headers (
+        height INTEGER PRIMARY KEY,
+        hash TEXT NOT NULL UNIQUE,
+        prev_hash TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS missing_heights (
+        height INTEGER PRIMARY KEY
+    )
+    ''',
+]
+
+
+class HeaderIndex:
+    def __init__(self, path=store.DEFAULT_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Entries not written to disk yet.
+        self.by_height = {}
+        self.by_hash = {}
+        self.missing = set()
+
+        conn = self.connection()
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = store.connect(self.path)
+        return conn
+
+    def add(self, height, hash, prev_hash):
+        with self.lock:
+            if height in self.by_height:
+                return
+            self.by_height[height] = (hash, prev_hash)
+            self.by_hash[hash] = (height, prev_hash)
+            flush = len(self.by_height) + len(self.missing) >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def add_missing(self, height):
+        with self.lock:
+            self.missing.add(height)
+            flush = len(self.by_height) + len(self.missing) >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def observe(self, block_id, response):
+        """Record a final block response (or a final UNKNOWN_BLOCK)."""
+        if 'result' in response:
+            header = response['result']['header']
+            self.add(header['height'], header['hash'], header['prev_hash'])
+        elif isinstance(block_id, int) and \
+                response.get('error', {}).get('cause', {}).get('name') == 'UNKNOWN_BLOCK':
+            self.add_missing(block_id)
+
+    def flush(self):
+        with self.lock:
+            by_height = dict(self.by_height)
+            missing = set(self.missing)
+        if not by_height and not missing:
+            return
+
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO headers (height, hash, prev_hash) VALUES (?, ?, ?)',
+                ((height, hash, prev_hash) for height, (hash, prev_hash) in by_height.items()))
+            conn.executemany(
+                'INSERT OR IGNORE INTO missing_heights (height) VALUES (?)',
+                ((height,) for height in missing))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+        # Only drop the pending copies once they can be read from disk.
+        with self.lock:
+            for height, (hash, _) in by_height.items():
+                self.by_height.pop(height, None)
+                self.by_hash.pop(hash, None)
+            self.missing -= missing
+
+    def hash_at(self, height):
+        with self.lock:
+            if height in self.by_height:
+                return self.by_height[height][0]
+        row = self.connection().execute(
+            'SELECT hash FROM headers WHERE height = ?', (height,)).fetchone()
+        return row[0] if row else None
+
+    def height_of(self, hash):
+        with self.lock:
+            if hash in self.by_hash:
+                return self.by_hash[hash][0]
+        row = self.connection().execute(
+            'SELECT height FROM headers WHERE hash = ?', (hash,)).fetchone()
+        return row[0] if row else None
+
+    def prev_hash(self, hash):
+        with self.lock:
+            if hash in self.by_hash:
+                return self.by_hash[hash][1]
+        row = self.connection().execute(
+            'SELECT prev_hash FROM headers WHERE hash = ?', (hash,)).fetchone()
+        return row[0] if row else None
+
+    def is_missing(self, height):
+        with self.lock:
+            if height in self.missing:
+                return True
+        return self.connection().execute(
+            'SELECT 1 FROM missing_heights WHERE height = ?', (height,)).fetchone() is not None
+
+    def close(self):
+        self.flush()
+
+
+default = store.Shared(HeaderIndex)
+
+
+# Hooks of the `block` helpers (sync and async), see `Policy.cached`.
+
+def resolve_block(args):
+    (block_id,) = args
+    if isinstance(block_id, int):
+        hash = default().hash_at(block_id)
+        if hash is not None:
+            return (hash,)
+    return args
+
+
+def canonical_block(args, result):
+    # Blocks are stored once, under their hash, whatever key fetched them.
+    if 'result' in result:
+        return (result['result']['header']['hash'],)
+    return args
+
+
+def observe_block(args, result):
+    # A block fetched by hash may still be orphaned; only index final ones.
+    if 'result' in result and result['result']['header']['height'] > policy.DEFAULT.final_height(refresh=False):
+        return
+    default().observe(args[0], result)
@@ -0,0 +1,154 @@
+"""
+Adaptive limiter for a shared RPC endpoint.
+
+Combines a token bucket (requests per second) with an AIMD concurrency
+limit:
+
+- every healthy response (fast enough, no error) grows the concurrency limit
+  by 1 / limit, i.e. by one per round of requests, and the rate by
+  `rate_step`,
+- a 429, 5xx or timeout halves both (at most once per round trip),
+- `Retry-After` stops all requests until the given time.
+
+`state()` returns the current values so they can be logged and tuned.
+"""
+import asyncio
+import email.utils
+import threading
+import time
+
+DEFAULT_RATE = 20
+DEFAULT_MAX_RATE = 200
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 64
+# A response is healthy if its latency is below this multiple of the best
+# latency observed so far.
+LATENCY_TOLERANCE = 3
+EWMA = 0.1
+POLL = 0.01
+
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Limiter:
+    def __init__(self, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 concurrency=DEFAULT_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 rate_step=1):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate_step = rate_step
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.best_latency = None
+        self.latency = None
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self.decreased = 0.0
+        self.cond = threading.Condition()
+
+    def _try_acquire(self):
+        """Take a token and a concurrency slot. Returns 0 on success, or the
+        number of seconds to wait before trying again."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+        if self.in_flight >= int(self.limit):
+            return POLL
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self.cond.wait(wait)
+
+    async def acquire_async(self):
+        while True:
+            with self.cond:
+                wait = self._try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def cancel(self):
+        """Give the slot back without counting the request."""
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def release(self, latency, ok, throttled=False, retry_after=None):
+        with self.cond:
+            self.in_flight -= 1
+
+            if ok:
+                self.successes += 1
+                self.latency = latency if self.latency is None else \
+                    (1 - EWMA) * self.latency + EWMA * latency
+                if self.best_latency is None or latency < self.best_latency:
+                    self.best_latency = latency
+                if latency <= LATENCY_TOLERANCE * self.best_latency:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                    self.rate = min(self.max_rate, self.rate + self.rate_step / max(1, self.rate))
+            else:
+                if throttled:
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                # Failures of requests that were already in flight when the
+                # limit was cut don't cut it again.
+                now = time.monotonic()
+                if now - self.decreased > (self.latency or 1.0):
+                    self.decreased = now
+                    self.limit = max(1.0, self.limit / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+            self.cond.notify_all()
+
+    def state(self):
+        with self.cond:
+            return dict(
+                rate=round(self.rate, 2),
+                concurrency=int(self.limit),
+                in_flight=self.in_flight,
+                latency=self.latency,
+                best_latency=self.best_latency,
+                paused_for=max(0.0, self.paused_until - time.monotonic()),
+                successes=self.successes,
+                throttled=self.throttled,
+                errors=self.errors,
+            )
+
+    def __repr__(self):
+        return f'Limiter({self.state()})'
@@ -0,0 +1,189 @@
+"""
+Append-only key-value log used by `utils.persist_to_file`.
+
+Each record is `klen | vlen | crc32 | key | value`, where key and value are
+bytes. Writing a new entry appends one record instead of rewriting the whole
+file. The index (key -> position of the value) is rebuilt on load. A torn
+record at the tail, left by a crash in the middle of a write, is truncated
+and every record before it is kept. A corrupted record followed by valid
+ones is skipped; if what follows can't be read either, loading fails rather
+than dropping the rest of the file.
+
+Files written by the previous implementation (a single pickled dict) are
+converted on first load.
+"""
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+MAGIC = b'NRLOG1\n'
+HEADER = struct.Struct('<III')
+
+# Compact when at least this fraction of the file is made of stale records.
+COMPACT_RATIO = 0.5
+COMPACT_MIN_SIZE = 1 << 20
+# Bytes searched for a valid record after a bad one, to tell a torn tail
+# from corruption in the middle of the log.
+SCAN_LIMIT = 1 << 20
+
+
+class LogStore:
+    def __init__(self, path, sync=False):
+        self.path = path
+        self.sync = sync
+        self.index = {}
+        self.live = 0
+        self.lock = threading.RLock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        if not os.path.exists(path):
+            self._create(path)
+        elif not self._is_log(path):
+            self._convert_legacy(path)
+
+        self._load()
+        self.file = open(path, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+        self.maybe_compact()
+
+    @staticmethod
+    def _is_log(path):
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def _create(path, items=()):
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            for key, value in items:
+                f.write(HEADER.pack(len(key), len(value), zlib.crc32(key + value)))
+                f.write(key)
+                f.write(value)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _convert_legacy(self, path):
+        try:
+            with open(path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            print(f'Unable to read {path}, moving it to {path}.corrupted')
+            os.replace(path, path + '.corrupted')
+            cache = {}
+
+        tmp = path + '.tmp'
+        self._create(tmp, ((key, pickle.dumps(value))
+                           for key, value in cache.items()))
+        os.replace(tmp, path)
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        pos = len(MAGIC)
+        while pos + HEADER.size <= len(data):
+            klen, vlen, crc = HEADER.unpack_from(data, pos)
+            start = pos + HEADER.size
+            end = start + klen + vlen
+            if not self._valid(data, pos):
+                if self._valid(data, end):
+                    # Corrupted in place, with valid records after it.
+                    print(f'{self.path}: skipping corrupted record at byte {pos}')
+                    pos = end
+                    continue
+                if not self._torn(data, pos, end):
+                    raise ValueError(f'{self.path}: corrupted record at byte {pos}')
+                break
+            key = data[start:start + klen]
+            if key in self.index:
+                self.live -= HEADER.size + klen + self.index[key][1]
+            self.index[key] = (start + klen, vlen)
+            self.live += HEADER.size + klen + vlen
+            pos = end
+
+        if pos != len(data):
+            print(f'{self.path}: dropping {len(data) - pos} bytes of truncated tail')
+            with open(self.path, 'r+b') as f:
+                f.truncate(pos)
+
+        self.size = pos
+
+    @staticmethod
+    def _valid(data, pos):
+        """Whether a complete record with a matching checksum starts at
+        `pos`. Keys are never empty, which rules out runs of zeros."""
+        if pos + HEADER.size > len(data):
+            return False
+        klen, vlen, crc = HEADER.unpack_from(data, pos)
+        start = pos + HEADER.size
+        end = start + klen + vlen
+        return klen > 0 and end <= len(data) and zlib.crc32(data[start:end]) == crc
+
+    @classmethod
+    def _torn(cls, data, pos, end):
+        """Whether the bad record at `pos` can only be the last one, cut by a
+        crash: no valid record starts in the `SCAN_LIMIT` bytes after it,
+        and either nothing else follows or its header runs past the end."""
+        limit = min(len(data), pos + SCAN_LIMIT)
+        if any(cls._valid(data, p) for p in range(pos + 1, limit - HEADER.size + 1)):
+            return False
+        return limit == len(data) or end > len(data)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        with self.lock:
+            offset, length = self.index[key]
+            self.file.seek(offset)
+            value = self.file.read(length)
+            self.file.seek(0, os.SEEK_END)
+            return value
+
+    def put(self, key, value):
+        if not key:
+            raise ValueError('Keys must not be empty')
+        with self.lock:
+            if key in self.index:
+                self.live -= HEADER.size + len(key) + self.index[key][1]
+
+            self.file.write(HEADER.pack(len(key), len(value), zlib.crc32(key + value)))
+            self.file.write(key)
+            self.file.write(value)
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+
+            self.index[key] = (self.size + HEADER.size + len(key), len(value))
+            record = HEADER.size + len(key) + len(value)
+            self.size += record
+            self.live += record
+            self.maybe_compact()
+
+    def maybe_compact(self):
+        stale = self.size - len(MAGIC) - self.live
+        if self.size >= COMPACT_MIN_SIZE and stale >= COMPACT_RATIO * self.size:
+            self.compact()
+
+    def compact(self):
+        tmp = self.path + '.tmp'
+        self._create(tmp, ((key, self.get(key)) for key in list(self.index)))
+        self.file.close()
+        os.replace(tmp, self.path)
+
+        self.index = {}
+        self.live = 0
+        self._load()
+        self.file = open(self.path, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.file.close()
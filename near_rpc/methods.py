@@ -0,0 +1,45 @@
+"""
+JSON-RPC request bodies for the methods used by the scripts. Shared by the
+sync (`near_rpc`) and async (`aio`) clients.
+"""
+import base64
+
+
+def request(method, params):
+    return {
+        "jsonrpc": "2.0",
+        "id": "dontcare",
+        "method": method,
+        "params": params
+    }
+
+
+def block(block_id):
+    return request("block", {"block_id": block_id})
+
+
+def chunk(chunk_id):
+    return request("chunk", {"chunk_id": chunk_id})
+
+
+def status():
+    return request("status", [])
+
+
+def call_function(account_id: str, method: str, args: bytes, block_id: int):
+    return request("query", {
+        "request_type": "call_function",
+        "block_id": block_id,
+        "account_id": account_id,
+        "method_name": method,
+        "args_base64": base64.b64encode(args).decode()
+    })
+
+
+def EXPERIMENTAL_light_client_proof(receipt_id: str, light_client_head: str, receiver_id: str = 'aurora'):
+    return request("EXPERIMENTAL_light_client_proof", {
+        "type": "receipt",
+        "receipt_id": receipt_id,
+        "receiver_id": receiver_id,
+        "light_client_head": light_client_head
+    })
@@ -0,0 +1,316 @@
+"""
+In-process counters and latency histograms for the RPC helpers.
+
+Everything is recorded in `REGISTRY`, which can be exported in the
+Prometheus text format or summarized in a single log line:
+
+    import metrics
+    metrics.serve(9100)        # http://127.0.0.1:9100/metrics
+    metrics.log_every(60)      # one summary line per minute on stderr
+    print(metrics.summary())
+
+Both can also be enabled from the environment, before the first request:
+
+    NEAR_RPC_METRICS_PORT=9100 NEAR_RPC_METRICS_LOG=60 python explore_balance.py
+
+Recorded:
+
+- `near_rpc_cache_total{method,tier}`: where each helper call was answered
+  (`memory`, `disk` or `network`).
+- `near_rpc_request_seconds{method}`: latency of every JSON-RPC request that
+  left the cache, including batching and retries.
+- `near_rpc_request_errors_total{method,error}`: responses with an error.
+- `near_rpc_http_seconds{endpoint}`, `near_rpc_http_responses_total{endpoint,status}`,
+  `near_rpc_bytes_sent_total{endpoint}`, `near_rpc_bytes_received_total{endpoint}`:
+  every HTTP round trip.
+- `near_rpc_retries_total{endpoint,reason}`, `near_rpc_hedges_total`,
+  `near_rpc_coalesced_total`, `near_rpc_batches_total`.
+
+Recording is a dict lookup and a short lock, cheap enough to leave on.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets grow by sqrt(2) from 1ms to ~3 minutes, so quantiles
+# interpolated inside a bucket are within ~20% of the real value.
+LATENCY_BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(36))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        ix = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[ix] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, q):
+        """Estimate, interpolating linearly inside the bucket that holds it."""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for ix, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[ix - 1] if ix > 0 else 0.0
+                upper = self.buckets[ix] if ix < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Family:
+    """A metric name and help text, with one child per set of label values."""
+
+    def __init__(self, kind, name, help, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.factory())
+        return child
+
+    def items(self):
+        with self.lock:
+            return list(self.children.items())
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def family(self, kind, name, help, factory):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = Family(kind, name, help, factory)
+            elif family.kind != kind:
+                raise ValueError(f'{name} is already registered as a {family.kind}')
+            return family
+
+    def counter(self, name, help=''):
+        return self.family('counter', name, help, Counter)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        return self.family('histogram', name, help, lambda: Histogram(buckets))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            families = list(self.families.values())
+        for family in families:
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for labels, child in family.items():
+                if family.kind == 'counter':
+                    lines.append(f'{family.name}{_labels_text(labels)} {child.value}')
+                    continue
+                with child.lock:
+                    counts = list(child.counts)
+                    total, sum_ = child.count, child.sum
+                cumulative = 0
+                for bound, count in zip(child.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f'{bound:.6g}'
+                    lines.append(f'{family.name}_bucket{_labels_text(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{family.name}_sum{_labels_text(labels)} {sum_}')
+                lines.append(f'{family.name}_count{_labels_text(labels)} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CACHE = REGISTRY.counter('near_rpc_cache_total', 'Helper calls by the tier that answered them')
+REQUEST_SECONDS = REGISTRY.histogram('near_rpc_request_seconds', 'JSON-RPC request latency')
+REQUEST_ERRORS = REGISTRY.counter('near_rpc_request_errors_total', 'JSON-RPC responses with an error')
+HTTP_SECONDS = REGISTRY.histogram('near_rpc_http_seconds', 'HTTP round trip latency')
+HTTP_RESPONSES = REGISTRY.counter('near_rpc_http_responses_total', 'HTTP responses by status')
+BYTES_SENT = REGISTRY.counter('near_rpc_bytes_sent_total', 'Request body bytes')
+BYTES_RECEIVED = REGISTRY.counter('near_rpc_bytes_received_total', 'Response body bytes')
+RETRIES = REGISTRY.counter('near_rpc_retries_total', 'HTTP requests sent again')
+HEDGES = REGISTRY.counter('near_rpc_hedges_total', 'Requests hedged to a second endpoint')
+COALESCED = REGISTRY.counter('near_rpc_coalesced_total', 'Requests merged with an identical in-flight one')
+BATCHES = REGISTRY.counter('near_rpc_batches_total', 'JSON-RPC batches sent')
+LEAVES_SAVED = REGISTRY.counter('near_rpc_leaves_saved_total', 'Leaf blocks not fetched thanks to cached subtree hashes')
+
+
+def cache_tiers(method):
+    """Counters of the three cache tiers of `method`, bound once so that
+    recording a hit is a single `inc()`."""
+    return {tier: CACHE.labels(method=method, tier=tier) for tier in ('memory', 'disk', 'network')}
+
+
+def observe_request(method, seconds, response):
+    REQUEST_SECONDS.labels(method=method).observe(seconds)
+    if isinstance(response, dict) and 'error' in response:
+        error = response['error']
+        name = error.get('cause', {}).get('name') or error.get('name') \
+            if isinstance(error, dict) else None
+        REQUEST_ERRORS.labels(method=method, error=name or 'unknown').inc()
+
+
+def observe_http(endpoint, seconds, status, sent, received):
+    HTTP_SECONDS.labels(endpoint=endpoint).observe(seconds)
+    HTTP_RESPONSES.labels(endpoint=endpoint, status=str(status)).inc()
+    BYTES_SENT.labels(endpoint=endpoint).inc(sent)
+    BYTES_RECEIVED.labels(endpoint=endpoint).inc(received)
+
+
+def render():
+    return REGISTRY.render()
+
+
+def summary():
+    """Plain dict with the totals of every metric and the quantiles of every
+    latency histogram, keyed by label values."""
+    result = {}
+    with REGISTRY.lock:
+        families = list(REGISTRY.families.values())
+    for family in families:
+        values = {}
+        for labels, child in family.items():
+            key = ','.join(str(v) for _, v in labels) or '_'
+            if family.kind == 'counter':
+                values[key] = child.value
+            else:
+                values[key] = dict(count=child.count, sum=child.sum,
+                                   **{f'p{int(q * 100)}': child.quantile(q) for q in QUANTILES})
+        result[family.name] = values
+    return result
+
+
+def _ms(value):
+    return '-' if value is None else f'{value * 1000:.0f}ms'
+
+
+def log_line():
+    """One line with the cache hit ratios, request latency quantiles per
+    method, retries and bytes transferred."""
+    tiers = {'memory': 0, 'disk': 0, 'network': 0}
+    for labels, child in CACHE.items():
+        tiers[dict(labels)['tier']] += child.value
+    total = sum(tiers.values())
+    parts = ['cache ' + ' '.join(
+        f'{tier}={count / total:.1%}' if total else f'{tier}=-' for tier, count in tiers.items())]
+
+    for labels, child in sorted(REQUEST_SECONDS.items()):
+        if child.count:
+            quantiles = '/'.join(_ms(child.quantile(q)) for q in QUANTILES)
+            parts.append(f'{dict(labels)["method"]} n={child.count} p50/95/99={quantiles}')
+
+    retries = sum(child.value for _, child in RETRIES.items())
+    sent = sum(child.value for _, child in BYTES_SENT.items())
+    received = sum(child.value for _, child in BYTES_RECEIVED.items())
+    parts.append(f'retries={retries} out={sent}B in={received}B')
+    return 'near_rpc: ' + ' | '.join(parts)
+
+
+def log_every(seconds, out=None):
+    """Print `log_line()` every `seconds` from a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(seconds)
+            print(log_line(), file=out or sys.stderr, flush=True)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        data = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve `render()` on `http://{host}:{port}/metrics` from a background
+    thread."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_started = False
+
+
+def start_from_env():
+    """Start the exporters asked for by `NEAR_RPC_METRICS_PORT` and
+    `NEAR_RPC_METRICS_LOG` (seconds). Only the first call does anything."""
+    global _started
+    if _started:
+        return
+    _started = True
+    if os.environ.get('NEAR_RPC_METRICS_PORT'):
+        serve(int(os.environ['NEAR_RPC_METRICS_PORT']))
+    if os.environ.get('NEAR_RPC_METRICS_LOG'):
+        log_every(float(os.environ['NEAR_RPC_METRICS_LOG']))
@@ -0,0 +1,226 @@
+"""
+Persistent merkle accumulator over the hashes of every block since genesis,
+in chain order: leaf `i` is the block with ordinal `i + 1` (skipped heights
+don't count).
+
+Leaves are appended once; every internal node of every complete subtree is
+stored as it is completed, one memory mapped file per level. Afterwards,
+with no network:
+
+- `range_hash(first, size)`: root of any `size` consecutive leaves,
+- `root(n)`: merkle root of the first `n` leaves, which is the
+  `block_merkle_root` of leaf `n`,
+- `proof(index, n)`: path from leaf `index` to `root(n)`, as in the
+  `block_proof` of a light client proof,
+
+each reading O(log n) nodes. The tree is the one built by nearcore's
+`merklize`: an unpaired node is carried to the next level unchanged.
+
+    python mmr.py build [end] [--headers path]
+
+Every level is kept, about 64 bytes per block plus 8 for its height.
+"""
+import bisect
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from headerstore import MappedFile
+
+HASH_SIZE = 32
+HEIGHT = struct.Struct('<Q')
+GROW = 1 << 16
+
+
+def combine(left, right):
+    return hashlib.sha256(left + right).digest()
+
+
+class Heights:
+    """Read only sequence view of the heights file, for `bisect`."""
+
+    def __init__(self, accumulator):
+        self.accumulator = accumulator
+
+    def __len__(self):
+        return len(self.accumulator)
+
+    def __getitem__(self, index):
+        return self.accumulator.height(index)
+
+
+class MerkleAccumulator:
+    def __init__(self, path='.mmr', writable=True):
+        self.path = path
+        self.writable = writable
+        self.levels = []
+        self.heights = MappedFile(path + '.heights', GROW * HEIGHT.size, writable)
+        self.count = 0
+        if os.path.exists(path + '.meta'):
+            with open(path + '.meta') as f:
+                self.count = json.load(f)['count']
+
+    def __len__(self):
+        return self.count
+
+    def level(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(MappedFile(f'{self.path}.L{len(self.levels)}', GROW * HASH_SIZE, self.writable))
+        return self.levels[level]
+
+    def node(self, level, index):
+        """Root of the leaves `[index * 2**level, (index + 1) * 2**level)`.
+        The subtree must be complete."""
+        if (index + 1) << level > self.count:
+            raise IndexError(f'Subtree {index} of level {level} is not complete')
+        offset = index * HASH_SIZE
+        return bytes(self.level(level).map[offset:offset + HASH_SIZE])
+
+    def _put(self, level, index, value):
+        f = self.level(level)
+        f.ensure((index + 1) * HASH_SIZE)
+        f.map[index * HASH_SIZE:(index + 1) * HASH_SIZE] = value
+
+    def height(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return HEIGHT.unpack_from(self.heights.map, index * HEIGHT.size)[0]
+
+    def leaf(self, index):
+        return self.node(0, index)
+
+    def append(self, hash, height):
+        """Add the next block. Completes the subtrees it closes."""
+        if self.count and height <= self.height(self.count - 1):
+            raise ValueError(f'Block {height} is not after {self.height(self.count - 1)}')
+
+        index = self.count
+        self.heights.ensure((index + 1) * HEIGHT.size)
+        HEIGHT.pack_into(self.heights.map, index * HEIGHT.size, height)
+        self._put(0, index, hash)
+        self.count += 1
+
+        level, value = 0, hash
+        while index % 2 == 1:
+            value = combine(self.node(level, index - 1), value)
+            level, index = level + 1, index // 2
+            self._put(level, index, value)
+
+    def extend(self, headers):
+        for header in headers:
+            self.append(header.hash, header.height)
+
+    def ordinal(self, height):
+        """Leaf index of the block at `height`, or None if it isn't a leaf."""
+        index = bisect.bisect_left(Heights(self), height)
+        return index if index < self.count and self.height(index) == height else None
+
+    def ordinal_at_or_after(self, height):
+        return bisect.bisect_left(Heights(self), height)
+
+    def range_hash(self, first, size):
+        """Root of the balanced tree over `size` leaves from `first`; `size`
+        is a power of two. Aligned ranges are a single stored node."""
+        if first + size > self.count:
+            raise IndexError(f'Leaves [{first}, {first + size}) are not all known')
+        level = size.bit_length() - 1
+        if first % size == 0:
+            return self.node(level, first >> level)
+        half = size // 2
+        return combine(self.range_hash(first, half), self.range_hash(first + half, half))
+
+    def _hash(self, start, count):
+        """Root of `count` leaves from `start`, carrying unpaired nodes."""
+        if count & (count - 1) == 0:
+            return self.node(count.bit_length() - 1, start // count)
+        left = 1 << (count - 1).bit_length() - 1
+        return combine(self.node(left.bit_length() - 1, start // left), self._hash(start + left, count - left))
+
+    def root(self, n=None):
+        """Merkle root of the first `n` leaves (all by default)."""
+        n = self.count if n is None else n
+        if n > self.count:
+            raise IndexError(f'Only {self.count} leaves')
+        if n == 0:
+            return bytes(HASH_SIZE)
+        return self._hash(0, n)
+
+    def proof(self, index, n=None):
+        """`[(hash, direction)]` from leaf `index` up to `root(n)`.
+        `direction` is the side of the sibling, 'Left' or 'Right'."""
+        n = self.count if n is None else n
+        if not 0 <= index < n <= self.count:
+            raise IndexError(f'Leaf {index} is not in the first {n}')
+
+        path = []
+        start, count = 0, n
+        while count > 1:
+            left = 1 << (count - 1).bit_length() - 1
+            if index < start + left:
+                path.append((self._hash(start + left, count - left), 'Right'))
+                count = left
+            else:
+                path.append((self._hash(start, left), 'Left'))
+                start, count = start + left, count - left
+        return path[::-1]
+
+    def flush(self):
+        if not self.writable:
+            return
+        for f in [self.heights] + self.levels:
+            if f.map is not None:
+                f.map.flush()
+        # The count is written last: leaves past it are ignored and
+        # overwritten after a crash.
+        tmp = self.path + '.meta.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(count=self.count), f)
+        os.replace(tmp, self.path + '.meta')
+
+    def close(self):
+        self.flush()
+        for f in [self.heights] + self.levels:
+            f.close()
+
+
+def fill(accumulator, end=None, source=None, flush_every=100000):
+    """Append every block from the last one ingested (genesis at first) up
+    to `end` (the final height by default). `source(start, end)` yields
+    headers in order; `near_rpc.iter_blocks` by default."""
+    from near_rpc import GENESIS_HEIGHT, iter_blocks, policy
+
+    source = source or iter_blocks
+    if end is None:
+        end = policy.final_height() + 1
+    start = accumulator.height(len(accumulator) - 1) + 1 if len(accumulator) else GENESIS_HEIGHT
+
+    for ix, header in enumerate(source(start, end)):
+        accumulator.append(header.hash, header.height)
+        if ix % flush_every == flush_every - 1:
+            accumulator.flush()
+    accumulator.flush()
+
+
+def main(argv):
+    if not argv or argv[0] != 'build':
+        print(__doc__)
+        exit(1)
+
+    source = None
+    if '--headers' in argv:
+        from headerstore import HeaderStore
+        ix = argv.index('--headers')
+        headers = HeaderStore(argv[ix + 1], writable=False)
+        source = headers.iter_blocks
+        argv = argv[:ix] + argv[ix + 2:]
+
+    accumulator = MerkleAccumulator()
+    fill(accumulator, int(argv[1]) if len(argv) > 1 else None, source)
+    print(f'{len(accumulator)} blocks, root {accumulator.root().hex()}')
+    accumulator.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
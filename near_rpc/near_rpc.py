@@ -1,90 +1,315 @@
 
-import base64
-from functools import lru_cache
 import dotmap
+import fastjson
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import json
-import utils
+import time
+import methods
+import metrics
+from batch import Batcher, BatchRejected, DEFAULT_BATCH_SIZE
+from endpoints import EndpointPool, from_env
+from header import BlockHeader, RpcError, UnknownBlock
+import index as header_index
+import policy as cache_policy
 
 URL = "https://archival-rpc.mainnet.near.org/"
 GENESIS_HEIGHT = 9820210
+# Regular (non archival) nodes keep about 5 epochs of 43200 blocks. Only
+# send them requests for blocks well inside that window.
+REGULAR_NODE_WINDOW = 2 * 43200
 
 
-headers = {
-    'Content-Type': 'application/json'
-}
+_client = None
+_batcher = None
+
+
+def configure(endpoints=None, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    """Replace the shared endpoint pool. `endpoints` is a list of
+    `{"url": ..., "archival": bool}`; it defaults to `NEAR_RPC_ENDPOINTS` /
+    `NEAR_RPC_ENDPOINTS_FILE` and then to the archival node at `URL`.
+    `batch_size=1` disables JSON-RPC batching. Other keyword arguments are
+    passed to every `Client` (pool_size, timeout, retries, backoff,
+    max_backoff)."""
+    global _client, _batcher
+    metrics.start_from_env()
+    if _client is not None:
+        _client.close()
+    if endpoints is None:
+        endpoints = from_env() or [dict(url=URL, archival=True)]
+    _client = EndpointPool(endpoints, **kwargs)
+    _batcher = Batcher(_send, batch_size=batch_size)
+    return _client
+
+
+def client():
+    if _client is None:
+        configure()
+    return _client
+
+
+def state():
+    """Latency, health and limiter state of every endpoint."""
+    return client().state()
+
+
+def needs_archival(payload):
+    if isinstance(payload, list):
+        return any(needs_archival(p) for p in payload)
+
+    params = payload['params']
+    if not isinstance(params, dict) or 'finality' in params:
+        return False
+
+    block_id = params.get('block_id', params.get('light_client_head'))
+    if isinstance(block_id, int):
+        final = policy.final_height(refresh=False)
+        return final == 0 or block_id < final - REGULAR_NODE_WINDOW
+
+    # Hashes (blocks, chunks, proof heads) of unknown age.
+    return True
+
+
+def batcher():
+    if _batcher is None:
+        configure()
+    return _batcher
+
+
+def _send(body):
+    try:
+        response = client().post(fastjson.dumps(body), archival=needs_archival(body))
+        return fastjson.loads(response.content)
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        if isinstance(body, list) and 400 <= status < 500 and status != 429:
+            raise BatchRejected(e)
+        raise
 
 
 def rpc(paylaod):
-    response = requests.request("POST", URL, headers=headers, data=paylaod)
-    res = dotmap.DotMap(response.json())
+    response = client().post(paylaod)
+    res = dotmap.DotMap(fastjson.loads(response.content))
     return res
 
 
-@lru_cache(2**15)
-@utils.memo
+def request_raw(payload):
+    """Send `payload` through the shared batcher, which merges it with
+    identical in-flight requests and packs it with concurrent ones. Returns
+    the decoded response as plain dicts and lists."""
+    start = time.monotonic()
+    response = batcher().call(payload)
+    metrics.observe_request(payload['method'], time.monotonic() - start, response)
+    return response
+
+
+def request(payload):
+    return dotmap.DotMap(request_raw(payload))
+
+
+def final_height():
+    return request(methods.request("block", {"finality": "final"})).result.header.height
+
+
+policy = cache_policy.DEFAULT
+policy.fetch_final_height = final_height
+
+
+def unknown_block():
+    return {"error": {"name": "HANDLER_ERROR", "cause": {"name": "UNKNOWN_BLOCK", "info": {}}}}
+
+
+@policy.cached(resolve=header_index.resolve_block, canonical=header_index.canonical_block,
+               observe=header_index.observe_block)
 def block(block_id):
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "block",
-        "params": {"block_id": block_id}
-    }))
+    if isinstance(block_id, int) and header_index.default().is_missing(block_id):
+        return unknown_block()
+    return request_raw(methods.block(block_id))
 
 
-@lru_cache(2**15)
-@utils.memo
+@policy.cached
 def chunk(chunk_id):
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "chunk",
-        "params": {"chunk_id": chunk_id}
-    }))
+    return request_raw(methods.chunk(chunk_id))
 
 
-@lru_cache(2**15)
-@utils.memo
+@policy.cached
 def status():
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "status",
-        "params": []
-    }))
+    return request_raw(methods.status())
 
 
-@lru_cache(2**15)
-@utils.memo
+@policy.cached
 def call_function(account_id: str, method: str, args: bytes, block_id: int):
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "query",
-        "params": {
-            "request_type": "call_function",
-            "block_id": block_id,
-            "account_id": account_id,
-            "method_name": method,
-            "args_base64": base64.b64encode(args).decode()
-        }
-    }))
-
-
-@lru_cache(2**15)
-@utils.memo
+    return request_raw(methods.call_function(account_id, method, args, block_id))
+
+
+@policy.cached
 def EXPERIMENTAL_light_client_proof(receipt_id: str, light_client_head: str, receiver_id: str = 'aurora'):
-    return rpc(json.dumps({
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "EXPERIMENTAL_light_client_proof",
-        "params": {
-            "type": "receipt",
-            "receipt_id": receipt_id,
-            "receiver_id": receiver_id,
-            "light_client_head": light_client_head
-        }
-    }))
+    return request_raw(methods.EXPERIMENTAL_light_client_proof(receipt_id, light_client_head, receiver_id))
 
 
 light_client_proof = EXPERIMENTAL_light_client_proof
+
+
+HEADERS_MAXSIZE = 2**18
+_headers = OrderedDict()
+_headers_lock = threading.Lock()
+_block_hits = metrics.cache_tiers('block')
+
+
+def block_header(block_id):
+    """Same as `block(block_id)` but returns a compact `BlockHeader`. Raises
+    `UnknownBlock` for skipped heights and `RpcError` for other errors. The
+    full block is not kept in memory."""
+    with _headers_lock:
+        if block_id in _headers:
+            _headers.move_to_end(block_id)
+            _block_hits['memory'].inc()
+            return _headers[block_id]
+
+    header = BlockHeader.from_response(block.raw(block_id))
+
+    if policy.permanent('block', (block_id,), refresh=False):
+        with _headers_lock:
+            _headers[block_id] = header
+            if len(_headers) > HEADERS_MAXSIZE:
+                _headers.popitem(last=False)
+
+    return header
+
+
+BlockHeader.loader = block
+
+
+ITER_WINDOW = 64
+
+
+def _header_or_none(height):
+    try:
+        return block_header(height)
+    except UnknownBlock:
+        return None
+
+
+def _chain(from_hash, to_hash, min_height):
+    """Headers from `from_hash` back to (excluding) `to_hash`, following
+    prev_hash links. Newest first."""
+    headers = []
+    header = block_header(BlockHeader.encode_hash(from_hash))
+    while header.hash != to_hash:
+        if header.height <= min_height:
+            raise RpcError(dict(name='INCONSISTENT_CHAIN', cause=dict(
+                name='INCONSISTENT_CHAIN', info=dict(height=header.height))))
+        headers.append(header)
+        header = block_header(header.prev_hash_b58)
+    return headers
+
+
+def iter_blocks(start, end, direction='forward', window=ITER_WINDOW):
+    """Yield the `BlockHeader` of every block with `start <= height < end`,
+    in increasing (`forward`) or decreasing (`backward`) height order.
+
+    Up to `window` heights ahead of the consumer are fetched in parallel.
+    Heights without a block are skipped, and consecutive headers are checked
+    against their `prev_hash` links: a block missed by height (e.g. a
+    transient UNKNOWN_BLOCK) is recovered by hash, so the chain yielded is
+    always complete."""
+    if direction not in ('forward', 'backward'):
+        raise ValueError(f'Unknown direction {direction}')
+    forward = direction == 'forward'
+    heights = iter(range(start, end) if forward else range(end - 1, start - 1, -1))
+
+    executor = ThreadPoolExecutor(max_workers=window)
+    queue = deque()
+
+    def fill():
+        while len(queue) < window:
+            height = next(heights, None)
+            if height is None:
+                break
+            queue.append(executor.submit(_header_or_none, height))
+
+    try:
+        fill()
+        last = None
+        while queue:
+            header = queue.popleft().result()
+            fill()
+            if header is None:
+                continue
+
+            if last is not None:
+                if forward and header.prev_hash != last.hash:
+                    yield from reversed(_chain(header.prev_hash, last.hash, last.height))
+                elif not forward and last.prev_hash != header.hash:
+                    yield from _chain(last.prev_hash, header.hash, header.height)
+
+            yield header
+            last = header
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# A skipped height is almost always alone: the height after it is probed on
+# its own first.
+NEAREST_SPAN = 1
+# Long empty runs are probed in spans of at most this many heights.
+NEAREST_MAX_SPAN = 1024
+
+
+def _first(headers):
+    try:
+        return next(headers, None)
+    finally:
+        headers.close()
+
+
+def nearest_block_at_or_after(height, limit=None):
+    """`BlockHeader` of the first block with `height <= block.height < limit`
+    (the final height by default), or None. `height` is probed alone, then
+    the heights after it in parallel, in spans that double while they are
+    empty; the empty ones are remembered as missing."""
+    if limit is None:
+        limit = policy.final_height() + 1
+
+    start, span = max(height, GENESIS_HEIGHT), NEAREST_SPAN
+    while start < limit:
+        end = min(start + span, limit)
+        header = _first(iter_blocks(start, end, window=min(end - start, ITER_WINDOW)))
+        if header is not None:
+            return header
+        start, span = end, min(span * 2, NEAREST_MAX_SPAN)
+    return None
+
+
+def nearest_block_at_or_before(height):
+    """`BlockHeader` of the last block with `block.height <= height`, or
+    None before genesis.
+
+    A skipped height is resolved through the first block after it: its
+    `prev_hash` is the block wanted, and every height in between is
+    recorded as missing, so no search walks that run again."""
+    if height < GENESIS_HEIGHT:
+        return None
+    try:
+        return block_header(height)
+    except UnknownBlock:
+        pass
+
+    after = nearest_block_at_or_after(height + 1)
+    if after is not None:
+        before = block_header(after.prev_hash_b58)
+        if after.height <= policy.final_height(refresh=False):
+            for missing in range(before.height + 1, after.height):
+                header_index.default().add_missing(missing)
+        return before
+
+    # Nothing final after `height`: walk back, from the final height at most.
+    end, span = min(height, policy.final_height()) + 1, NEAREST_SPAN
+    while end > GENESIS_HEIGHT:
+        start = max(end - span, GENESIS_HEIGHT)
+        header = _first(iter_blocks(start, end, 'backward', window=min(end - start, ITER_WINDOW)))
+        if header is not None:
+            return header
+        end, span = start, min(span * 2, NEAREST_MAX_SPAN)
+    return None
@@ -0,0 +1,177 @@
+"""
+Finality aware caching for the RPC helpers.
+
+Responses that can't change are cached in memory and on disk for ever:
+anything keyed by a block or chunk hash, and anything keyed by a height at
+or below the last known final height. Everything else (`status()`, queries
+near the head of the chain) is only kept in memory for `ttl` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from dotmap import DotMap
+
+import metrics
+import store
+import utils
+
+TTL = 5
+FINAL_HEIGHT_TTL = 10
+MAXSIZE = 2**15
+
+# Position of the block reference among the arguments of each method.
+BLOCK_ARG = {
+    'block': 0,
+    'chunk': 0,
+    'call_function': 3,
+    'EXPERIMENTAL_light_client_proof': 1,
+}
+
+
+class Policy:
+    def __init__(self, fetch_final_height=None, ttl=TTL):
+        self.fetch_final_height = fetch_final_height
+        self.ttl = ttl
+        self.final = 0
+        self.checked = 0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def note_final_height(self, height):
+        with self.lock:
+            self.final = max(self.final, height)
+
+    def final_height(self, at_least=None, refresh=True):
+        """Last known final height. Ask the node again if it is older than
+        FINAL_HEIGHT_TTL seconds and below `at_least`."""
+        if refresh and self.fetch_final_height is not None and self.stale(at_least):
+            # Concurrent callers wait for the fetch in flight instead of
+            # answering with a height that is about to change.
+            with self.refresh_lock:
+                if self.stale(at_least):
+                    self.refreshed(self.fetch_final_height())
+        return self.final
+
+    def stale(self, at_least=None):
+        """Whether the final height should be asked again before deciding
+        about `at_least`."""
+        wanted = at_least is None or at_least > self.final
+        return wanted and time.time() - self.checked > FINAL_HEIGHT_TTL
+
+    def refreshed(self, height):
+        self.note_final_height(height)
+        self.checked = time.time()
+
+    def block_height(self, name, args):
+        """Height `args` refer to, or None (hashes, no block argument)."""
+        if name not in BLOCK_ARG or len(args) <= BLOCK_ARG[name]:
+            return None
+        block_id = args[BLOCK_ARG[name]]
+        return block_id if isinstance(block_id, int) else None
+
+    def permanent(self, name, args, refresh=True):
+        if name not in BLOCK_ARG or len(args) <= BLOCK_ARG[name]:
+            return False
+
+        block_id = args[BLOCK_ARG[name]]
+        if isinstance(block_id, str):
+            # Hashes. 'final' / 'optimistic' aren't passed as block ids.
+            return True
+        return block_id <= self.final_height(at_least=block_id, refresh=refresh)
+
+    def cached(self, func=None, maxsize=MAXSIZE, resolve=None, canonical=None, observe=None):
+        """Replaces `lru_cache` + `utils.memo`. Permanent results go to a
+        bounded LRU and to disk, the rest to a short-lived TTL tier. `func`
+        returns plain dicts, which are wrapped in a DotMap once when they
+        enter the memory tiers.
+
+        Optional hooks for results that can be requested under several keys:
+        `resolve(args)` gives the key to look up on disk first,
+        `canonical(args, result)` the key to store a result under, and
+        `observe(args, result)` is called with every permanent result."""
+        if func is None:
+            return lambda func: self.cached(func, maxsize, resolve, canonical, observe)
+
+        name = func.__name__
+        permanent = OrderedDict()
+        volatile = {}
+        lock = threading.Lock()
+        hits = metrics.cache_tiers(name)
+
+        def load(*args):
+            """Disk tier, then network. Returns the result and whether it is
+            permanent."""
+            is_permanent = self.permanent(name, args)
+
+            result = None
+            if is_permanent:
+                key_args = resolve(args) if resolve is not None else args
+                result = store.default().get(name, utils.memo_key(key_args))
+                if result is None and key_args != args:
+                    result = store.default().get(name, utils.memo_key(args))
+                if result is not None:
+                    hits['disk'].inc()
+
+            if result is None:
+                hits['network'].inc()
+                result = func(*args)
+                is_permanent = is_permanent and not transient(result)
+                if is_permanent:
+                    key_args = canonical(args, result) if canonical is not None else args
+                    utils.memo_store(name, key_args, result)
+
+            if is_permanent and observe is not None:
+                observe(args, result)
+
+            return result, is_permanent
+
+        def wrapper(*args):
+            with lock:
+                if args in permanent:
+                    permanent.move_to_end(args)
+                    hits['memory'].inc()
+                    return permanent[args]
+                if args in volatile:
+                    expires, result = volatile[args]
+                    if expires > time.time():
+                        hits['memory'].inc()
+                        return result
+                    del volatile[args]
+
+            result, is_permanent = load(*args)
+            result = DotMap(result)
+
+            with lock:
+                if is_permanent:
+                    permanent[args] = result
+                    if len(permanent) > maxsize:
+                        permanent.popitem(last=False)
+                else:
+                    now = time.time()
+                    if len(volatile) >= maxsize:
+                        for key in [k for k, (e, _) in volatile.items() if e <= now]:
+                            del volatile[key]
+                    if len(volatile) < maxsize:
+                        volatile[args] = (now + self.ttl, result)
+
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = func.__doc__
+        # Plain dicts, bypassing the memory tiers and DotMap, for callers
+        # that keep their own compact copy of the result.
+        wrapper.raw = lambda *args: load(*args)[0]
+        return wrapper
+
+
+def transient(result):
+    """Errors that may go away on retry (timeouts, internal errors) are never
+    cached permanently. Handler errors such as UNKNOWN_BLOCK are."""
+    return isinstance(result, (dict, DotMap)) and 'error' in result and \
+        result['error'].get('name') != 'HANDLER_ERROR'
+
+
+# Shared by the sync helpers in `near_rpc` (which set `fetch_final_height`)
+# and by `aio`, so both agree on what is final.
+DEFAULT = Policy()
@@ -0,0 +1,177 @@
+"""
+Change point search over block heights.
+
+`change_points(probe, lo, hi)` finds every height where `probe(height)`
+changes between `lo` and `hi`. Instead of bisecting, each interval is split
+in `k` parts and the `k - 1` new probes, together with those of the
+following intervals, are evaluated concurrently. A search over the whole
+chain waits for ~log_k(hi - lo) rounds instead of log_2(hi - lo) sequential
+round trips.
+
+`batch_change_points(targets, lo, hi)` runs the same search for many
+probes (one per token, address, ...) at once. All targets split their
+intervals at the same heights, so the probes of one round hit a few block
+heights shared by every target. They are deduplicated and sent sorted by
+height, so the RPC batcher packs calls on the same block together.
+
+Both keep the frontier in an explicit queue. With `checkpoint=path` it is
+saved after every round, and a restarted search continues from there: the
+changes found before are yielded again first, then the search resumes
+without probing the settled intervals again.
+
+Like the hand written bisections it replaces, it assumes the probe is
+monotone-ish: an interval whose ends have the same value is assumed not to
+change inside.
+"""
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_K = 8
+DEFAULT_WINDOW = 64
+
+
+def split_points(lo, hi, k):
+    """Up to `k - 1` heights strictly inside (lo, hi), evenly spaced."""
+    if hi - lo <= k:
+        return list(range(lo + 1, hi))
+    points = (lo + (hi - lo) * i // k for i in range(1, k))
+    return sorted(set(p for p in points if lo < p < hi))
+
+
+def load_checkpoint(path):
+    """State saved by a search with `checkpoint=path`, or None."""
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_checkpoint(path, state):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def checkpoint_range(path):
+    """`(lo, hi)` of the search saved in `path`, or None. Lets a job whose
+    upper bound moves (e.g. the chain head) resume with the bounds it
+    started with."""
+    state = load_checkpoint(path)
+    return (state['lo'], state['hi']) if state is not None else None
+
+
+def change_points(probe, lo, hi, value_lo=None, value_hi=None, k=DEFAULT_K, window=DEFAULT_WINDOW,
+                  reverse=False, checkpoint=None):
+    """Yield `(height, before, after)` for every `height` in (lo, hi] with
+    `probe(height - 1) == before != after == probe(height)`, in increasing
+    height order (decreasing with `reverse`), as soon as everything before
+    it is settled.
+
+    `value_lo` / `value_hi` are the known values at `lo` / `hi`. Up to
+    `window` probes run concurrently; `probe` must be thread safe. Values
+    must be picklable when `checkpoint` is given."""
+    known = {(None, h): v for h, v in ((lo, value_lo), (hi, value_hi)) if v is not None}
+    for _, height, before, after in batch_change_points(
+            {None: probe}, lo, hi, known, k=k, window=window, reverse=reverse, checkpoint=checkpoint):
+        yield height, before, after
+
+
+def batch_change_points(targets, lo, hi, known=None, k=DEFAULT_K, window=DEFAULT_WINDOW, reverse=False,
+                        checkpoint=None):
+    """Same as `change_points` for every `key: probe` in `targets`. Yields
+    `(key, height, before, after)`; the changes of each key come in height
+    order. `known` maps `(key, height)` to values already known."""
+    if k < 2:
+        raise ValueError('k must be at least 2')
+    known = known or {}
+
+    job = dict(lo=lo, hi=hi, keys=list(targets), reverse=reverse)
+    state = load_checkpoint(checkpoint)
+    if state is not None and state['job'] != job:
+        raise ValueError(f'{checkpoint} belongs to another search: {state["job"]}')
+
+    executor = ThreadPoolExecutor(max_workers=window)
+
+    def evaluate(calls):
+        """Values of the distinct `(probe, height)` in `calls`, fetched in
+        height order."""
+        calls = sorted(set(calls), key=lambda call: call[1])
+        return dict(zip(calls, executor.map(lambda call: call[0](call[1]), calls)))
+
+    try:
+        if state is not None:
+            pending, found = state['pending'], state['found']
+            yield from found
+        else:
+            values = evaluate((probe, h) for key, probe in targets.items() for h in (lo, hi)
+                              if (key, h) not in known)
+
+            # Per key, disjoint intervals (lo, value_lo, hi, value_hi) whose
+            # ends differ, ordered by height.
+            pending = {}
+            for key, probe in targets.items():
+                value_lo = known[key, lo] if (key, lo) in known else values[probe, lo]
+                value_hi = known[key, hi] if (key, hi) in known else values[probe, hi]
+                pending[key] = [(lo, value_lo, hi, value_hi)] if value_lo != value_hi else []
+            found = []
+
+        front = -1 if reverse else 0
+        while True:
+            # Settled intervals at the front are reported right away. They
+            # are checkpointed before being yielded, so none is lost if the
+            # consumer dies while handling it.
+            settled = []
+            for key, intervals in pending.items():
+                while intervals and intervals[front][0] + 1 == intervals[front][2]:
+                    lo, before, hi, after = intervals.pop(front)
+                    settled.append((key, hi, before, after))
+            found.extend(settled)
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, dict(job=job, pending=pending, found=found))
+            yield from settled
+            if not any(pending.values()):
+                break
+
+            # Split as many intervals as fit in the window, nearest to the
+            # front first. Intervals of different keys that start at the
+            # same height are split at the same heights.
+            candidates = sorted(
+                ((-interval[2] if reverse else interval[0], key, ix)
+                 for key, intervals in pending.items()
+                 for ix, interval in enumerate(intervals) if interval[0] + 1 < interval[2]),
+                key=lambda candidate: candidate[0])
+            chosen = {}
+            calls = set()
+            for _, key, ix in candidates:
+                lo, _, hi, _ = pending[key][ix]
+                points = split_points(lo, hi, k)
+                new = {(targets[key], p) for p in points} - calls
+                if calls and len(calls) + len(new) > window:
+                    break
+                chosen[key, ix] = points
+                calls |= new
+
+            values = evaluate(calls)
+
+            for key, intervals in pending.items():
+                split = []
+                for ix, interval in enumerate(intervals):
+                    if (key, ix) not in chosen:
+                        split.append(interval)
+                        continue
+                    lo, value_lo, hi, value_hi = interval
+                    bounds = [(lo, value_lo)] + [(h, values[targets[key], h]) for h in chosen[key, ix]] + \
+                        [(hi, value_hi)]
+                    for (a, value_a), (b, value_b) in zip(bounds, bounds[1:]):
+                        if value_a != value_b:
+                            split.append((a, value_a, b, value_b))
+                pending[key] = split
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,5 @@
 from distutils.core import setup
 setup(name='near_rpc',
       version='0.1',
-      py_modules=['near_rpc'],
+      py_modules=['near_rpc', 'aio', 'batch', 'client', 'endpoints', 'epochs', 'fake_server', 'fastjson', 'header', 'headerstore', 'index', 'limiter', 'logstore', 'methods', 'metrics', 'mmr', 'policy', 'search', 'store', 'utils'],
       )
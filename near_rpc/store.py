@@ -0,0 +1,382 @@
+"""
+Single file response cache backed by SQLite.
+
+Values are stored as compressed compact JSON (zstd when `zstandard` is
+installed, zlib otherwise). The database runs in WAL mode so several
+processes can read and write it at the same time.
+
+With a byte budget (`NEAR_RPC_CACHE_BUDGET`, e.g. `20G`) the least recently
+used (`NEAR_RPC_CACHE_EVICTION=lru`, default) or least frequently used
+(`lfu`) entries are evicted when the cache grows past it.
+
+    python store.py import [.memo] [.memo.sqlite]   import a one-file-per-call tree
+    python store.py stats [.memo.sqlite]            hit ratio, bytes per method, oldest and largest entries
+    python store.py evict <.memo.sqlite> <budget>   shrink the cache to <budget> bytes (e.g. 20G)
+"""
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import fastjson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_PATH = '.memo.sqlite'
+BUSY_TIMEOUT = 60
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Access times and hit counters are buffered and written in one transaction
+# every FLUSH_EVERY operations.
+FLUSH_EVERY = 1000
+# Evict down to this fraction of the budget, so eviction doesn't run on
+# every write once the cache is full.
+EVICT_TARGET = 0.9
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS cache (
+        method TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BLOB NOT NULL,
+        PRIMARY KEY (method, key)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS counters (
+        method TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+]
+
+# Columns added after the first version of the table.
+COLUMNS = [
+    ('size', 'INTEGER NOT NULL DEFAULT 0'),
+    ('created', 'REAL NOT NULL DEFAULT 0'),
+    ('accessed', 'REAL NOT NULL DEFAULT 0'),
+    ('hits', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+EVICTION_ORDER = {
+    'lru': 'accessed ASC',
+    'lfu': 'hits ASC, accessed ASC',
+}
+
+
+def parse_size(value):
+    if value is None or value == '':
+        return None
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def encode(value):
+    if hasattr(value, 'toDict'):
+        value = value.toDict()
+    raw = fastjson.dumps(value)
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return zlib.compress(raw)
+
+
+def decode(data):
+    data = bytes(data)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read this cache')
+        return fastjson.loads(zstandard.ZstdDecompressor().decompress(data))
+    return fastjson.loads(zlib.decompress(data))
+
+
+def connect(path):
+    """Autocommit connection to the SQLite file at `path`, in WAL mode, so
+    several processes can use it at once. The cache, the header index and
+    the epoch table share the file."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class Shared:
+    """Instance shared by the whole process, built by `create` on first use
+    and closed at exit. Called from worker threads (iter_blocks); only one
+    may build it."""
+
+    def __init__(self, create):
+        self.create = create
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.instance is None:
+                self.instance = self.create()
+                atexit.register(self.instance.close)
+        return self.instance
+
+    def reset(self):
+        """Close the instance; the next call builds a new one."""
+        with self.lock:
+            if self.instance is not None:
+                atexit.unregister(self.instance.close)
+                self.instance.close()
+                self.instance = None
+
+
+class Store:
+    def __init__(self, path=DEFAULT_PATH, budget=None, eviction='lru'):
+        if eviction not in EVICTION_ORDER:
+            raise ValueError(f'Unknown eviction policy {eviction}')
+
+        self.path = path
+        self.budget = budget
+        self.eviction = eviction
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.touched = {}
+        self.counters = {}
+        self.pending = 0
+        self.written = 0
+
+        conn = self.connection()
+        for statement in SCHEMA:
+            conn.execute(statement)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(cache)')}
+        for name, definition in COLUMNS:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE cache ADD COLUMN {name} {definition}')
+                if name == 'size':
+                    conn.execute('UPDATE cache SET size = length(value)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def connection(self):
+        # sqlite3 connections can't be shared between threads.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def count(self, method, hit):
+        with self.lock:
+            hits, misses = self.counters.get(method, (0, 0))
+            self.counters[method] = (hits + hit, misses + (not hit))
+            self.pending += 1
+            flush = self.pending >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def get(self, method, key):
+        row = self.connection().execute(
+            'SELECT value FROM cache WHERE method = ? AND key = ?', (method, key)).fetchone()
+        if row is None:
+            self.count(method, False)
+            return None
+
+        with self.lock:
+            _, hits = self.touched.get((method, key), (0, 0))
+            self.touched[(method, key)] = (time.time(), hits + 1)
+        self.count(method, True)
+        return decode(row[0])
+
+    def put(self, method, key, value):
+        self.put_many([(method, key, value)])
+
+    def put_many(self, rows):
+        now = time.time()
+        encoded = [(method, key, encode(value))
+                   for method, key, value in rows]
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO cache (method, key, value, size, created, accessed, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                ((method, key, value, len(value), now, now) for method, key, value in encoded))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+        if self.budget is not None:
+            with self.lock:
+                self.written += sum(len(value) for _, _, value in encoded)
+                check = self.written >= (1 - EVICT_TARGET) * self.budget / 4
+            if check:
+                self.written = 0
+                self.evict(self.budget)
+
+    def flush(self):
+        with self.lock:
+            touched, self.touched = self.touched, {}
+            counters, self.counters = self.counters, {}
+            self.pending = 0
+        if not touched and not counters:
+            return
+
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'UPDATE cache SET accessed = ?, hits = hits + ? WHERE method = ? AND key = ?',
+                ((accessed, hits, method, key) for (method, key), (accessed, hits) in touched.items()))
+            conn.executemany(
+                'INSERT INTO counters (method, hits, misses) VALUES (?, ?, ?) '
+                'ON CONFLICT (method) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses',
+                ((method, hits, misses) for method, (hits, misses) in counters.items()))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def total_size(self):
+        return self.connection().execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def evict(self, budget):
+        """Delete entries, in eviction order, until the cache holds at most
+        EVICT_TARGET * budget bytes. Returns the number of bytes freed."""
+        self.flush()
+        total = self.total_size()
+        if total <= budget:
+            return 0
+
+        excess = total - int(EVICT_TARGET * budget)
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            victims = []
+            freed = 0
+            cursor = conn.execute(
+                f'SELECT method, key, size FROM cache ORDER BY {EVICTION_ORDER[self.eviction]}')
+            for method, key, size in cursor:
+                if freed >= excess:
+                    break
+                victims.append((method, key))
+                freed += size
+            cursor.close()
+            conn.executemany(
+                'DELETE FROM cache WHERE method = ? AND key = ?', victims)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return freed
+
+    def stats(self, top=10):
+        self.flush()
+        conn = self.connection()
+        methods = conn.execute(
+            'SELECT method, COUNT(*), SUM(size) FROM cache GROUP BY method ORDER BY method').fetchall()
+        counters = {method: (hits, misses) for method, hits, misses in conn.execute(
+            'SELECT method, hits, misses FROM counters')}
+        oldest = conn.execute(
+            'SELECT method, key, size, created FROM cache ORDER BY created ASC LIMIT ?', (top,)).fetchall()
+        largest = conn.execute(
+            'SELECT method, key, size, created FROM cache ORDER BY size DESC LIMIT ?', (top,)).fetchall()
+        return dict(
+            methods=[dict(method=method, entries=entries, bytes=size,
+                          hits=counters.get(method, (0, 0))[0],
+                          misses=counters.get(method, (0, 0))[1])
+                     for method, entries, size in methods],
+            oldest=[dict(method=m, key=k, bytes=s, created=c)
+                    for m, k, s, c in oldest],
+            largest=[dict(method=m, key=k, bytes=s, created=c)
+                     for m, k, s, c in largest],
+        )
+
+    def close(self):
+        self.flush()
+
+
+default = Shared(lambda: Store(
+    budget=parse_size(os.environ.get('NEAR_RPC_CACHE_BUDGET')),
+    eviction=os.environ.get('NEAR_RPC_CACHE_EVICTION', 'lru')))
+
+
+def read_memo_tree(folder):
+    for method in sorted(os.listdir(folder)):
+        method_folder = os.path.join(folder, method)
+        if not os.path.isdir(method_folder):
+            continue
+        for key in os.listdir(method_folder):
+            with open(os.path.join(method_folder, key)) as f:
+                try:
+                    value = json.load(f)
+                except json.JSONDecodeError:
+                    print(f'Skipping corrupted entry {method}/{key}')
+                    continue
+            yield method, key, value
+
+
+def import_memo_tree(folder, store, chunk_size=10000):
+    total = 0
+    rows = []
+    for row in read_memo_tree(folder):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            store.put_many(rows)
+            total += len(rows)
+            rows = []
+            print(f'Imported {total} entries', flush=True)
+    store.put_many(rows)
+    total += len(rows)
+    print(f'Imported {total} entries')
+    return total
+
+
+def print_stats(stats):
+    import humanize
+
+    def when(ts):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+    print(f'{"method":<36} {"entries":>10} {"size":>10} {"hit ratio":>10}')
+    for row in stats['methods']:
+        lookups = row['hits'] + row['misses']
+        ratio = f'{row["hits"] / lookups:.1%}' if lookups else '-'
+        print(f'{row["method"]:<36} {row["entries"]:>10} {humanize.naturalsize(row["bytes"]):>10} {ratio:>10}')
+
+    print('\nOldest entries:')
+    for row in stats['oldest']:
+        print(f'  {when(row["created"])} {row["method"]}/{row["key"]}')
+
+    print('\nLargest entries:')
+    for row in stats['largest']:
+        print(f'  {humanize.naturalsize(row["bytes"]):>10} {row["method"]}/{row["key"]}')
+
+
+def main(argv):
+    command = argv[0] if argv else None
+
+    if command == 'import':
+        folder = argv[1] if len(argv) > 1 else '.memo'
+        path = argv[2] if len(argv) > 2 else DEFAULT_PATH
+        import_memo_tree(folder, Store(path))
+    elif command == 'stats':
+        path = argv[1] if len(argv) > 1 else DEFAULT_PATH
+        print_stats(Store(path).stats())
+    elif command == 'evict' and len(argv) == 3:
+        store = Store(argv[1], eviction=os.environ.get(
+            'NEAR_RPC_CACHE_EVICTION', 'lru'))
+        freed = store.evict(parse_size(argv[2]))
+        print(f'Freed {freed} bytes')
+    else:
+        print(__doc__)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,47 +1,79 @@
-import json
-import os
 import pickle
 
 from dotmap import DotMap
 
+import metrics
+import store
+from logstore import LogStore
+
 
 def persist_to_file(file_name):
     def decorator(original_func):
-        try:
-            cache = pickle.load(open(file_name, 'rb'))
-        except:
-            cache = {}
+        cache = LogStore(file_name)
 
         def new_func(*args, **kwargs):
             key = pickle.dumps([args, kwargs])
-            if key not in cache:
-                cache[key] = original_func(*args, **kwargs)
-                pickle.dump(cache, open(file_name, 'wb'))
-            return cache[key]
+            if key in cache:
+                return pickle.loads(cache.get(key))
+            result = original_func(*args, **kwargs)
+            cache.put(key, pickle.dumps(result))
+            return result
 
         return new_func
 
     return decorator
 
 
-TARGET_FOLDER = '.memo'
+def memo_key(args):
+    # Same key as the file name used by the old `.memo/<func>/<args>` layout,
+    # so imported trees are hit.
+    return '-'.join(map(str, args))
+
+
+def memo_load(name, args):
+    # Responses are dicts; other values, like the subtree roots of
+    # debug_near_block_proof, are returned as they are.
+    result = store.default().get(name, memo_key(args))
+    if isinstance(result, dict):
+        return DotMap(result)
+    return result
+
+
+def memo_store(name, args, result):
+    store.default().put(name, memo_key(args), result)
 
 
 def memo(func):
-    def func_memo(*args):
-        target_folder = os.path.join(TARGET_FOLDER, func.__name__)
-        os.makedirs(target_folder, exist_ok=True)
-        target_file = os.path.join(target_folder, '-'.join(map(str, args)))
+    hits = metrics.cache_tiers(func.__name__)
 
-        if os.path.exists(target_file):
-            with open(target_file, 'r') as f:
-                return DotMap(json.load(f))
+    def func_memo(*args):
+        result = memo_load(func.__name__, args)
+        if result is not None:
+            hits['disk'].inc()
+            return result
 
+        hits['network'].inc()
         result = func(*args)
+        memo_store(func.__name__, args, result)
+        return result
+
+    return func_memo
+
+
+def amemo(func):
+    """Same as `memo` for coroutines. Entries are shared with `memo` as long
+    as the wrapped functions have the same name."""
+    hits = metrics.cache_tiers(func.__name__)
 
-        with open(target_file, 'w') as f:
-            json.dump(result, f, indent=2)
+    async def func_memo(*args):
+        result = memo_load(func.__name__, args)
+        if result is not None:
+            hits['disk'].inc()
+            return result
 
+        hits['network'].inc()
+        result = await func(*args)
+        memo_store(func.__name__, args, result)
         return result
 
     return func_memo
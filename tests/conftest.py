@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Root scripts import the `near_rpc` package, whose modules import each other
+# by their bare names.
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'near_rpc'))
+
+import base58 as b58  # noqa: E402
+
+import epochs  # noqa: E402
+import fake_server  # noqa: E402
+import index  # noqa: E402
+import near_rpc  # noqa: E402
+import policy  # noqa: E402
+import store  # noqa: E402
+import utils  # noqa: E402
+
+GENESIS = near_rpc.GENESIS_HEIGHT
+
+
+def block_hash(height):
+    return b58.b58encode(hashlib.sha256(str(height).encode()).digest()).decode()
+
+
+def block(height, prev_height=None):
+    h = block_hash(height)
+    header = dict(height=height, hash=h, prev_hash=block_hash(height - 1 if prev_height is None else prev_height),
+                  epoch_id=block_hash(0), next_epoch_id=block_hash(1), block_merkle_root=h,
+                  timestamp=str(1630000000000000000 + height))
+    return {'jsonrpc': '2.0', 'id': 'dontcare', 'result': {'header': header, 'chunks': []}}
+
+
+class Chain:
+    """Responses served by a `fake_server`, recorded in its own SQLite file."""
+
+    def __init__(self, path):
+        self.fixtures = fake_server.Fixtures(memo=path)
+        self.faults = fake_server.Faults()
+        self.server = fake_server.serve(self.fixtures, self.faults)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    @property
+    def requests(self):
+        return self.faults.requests
+
+    def add(self, method, args, response):
+        self.fixtures.memo.put(method, utils.memo_key(args), response)
+        self.fixtures.memo.flush()
+
+    def add_blocks(self, heights, final_height=None):
+        """Blocks at `heights`, each linked to the previous one."""
+        prev = None
+        for height in heights:
+            response = block(height, prev)
+            self.add('block', (height,), response)
+            self.add('block', (block_hash(height),), response)
+            prev = height
+        self.fixtures.final_height = final_height or heights[-1]
+
+    def close(self):
+        self.server.shutdown()
+
+
+def reset():
+    for module in (store, index, epochs):
+        module.default.reset()
+    policy.DEFAULT.final = 0
+    policy.DEFAULT.checked = 0
+    near_rpc.near_rpc._headers.clear()
+
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    """Empty chain served by a fake node, with the caches of the test
+    isolated in `tmp_path`. Tests use distinct heights, since the memory
+    tiers of the helpers outlive a test."""
+    monkeypatch.chdir(tmp_path)
+    reset()
+    chain = Chain(str(tmp_path / 'fixtures.sqlite'))
+    near_rpc.configure([dict(url=chain.url, archival=True)])
+    yield chain
+    chain.close()
+    reset()
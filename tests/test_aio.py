@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from conftest import GENESIS
+
+pytest.importorskip('aiohttp')
+
+import metrics  # noqa: E402
+from aio import AsyncClient  # noqa: E402
+from limiter import Limiter  # noqa: E402
+
+
+def fetch_blocks(url, heights):
+    async def fetch():
+        async with AsyncClient(url=url) as client:
+            return [await client.block(height) for height in heights]
+    return asyncio.run(fetch())
+
+
+def test_async_client_block(chain):
+    height = GENESIS + 2000
+    chain.add_blocks([height])
+
+    block, = fetch_blocks(chain.url, [height])
+    assert block.result.header.height == height
+
+
+def test_async_client_block_from_disk(chain):
+    height = GENESIS + 2100
+    chain.add_blocks([height, height + 1])
+    disk = metrics.cache_tiers('block')['disk']
+
+    fetch_blocks(chain.url, [height])
+    requests, hits = chain.requests, disk.value
+    block, = fetch_blocks(chain.url, [height])
+
+    assert block.result.header.height == height
+    assert chain.requests == requests
+    assert disk.value == hits + 1
+
+
+def test_async_client_reads_blocks_stored_by_sync_client(chain):
+    import near_rpc
+
+    height = GENESIS + 2200
+    chain.add_blocks([height, height + 1])
+    near_rpc.block(height)
+    requests = chain.requests
+
+    block, = fetch_blocks(chain.url, [height])
+    assert block.result.header.height == height
+    assert chain.requests == requests
+
+
+def test_async_client_defaults_from_env(chain, monkeypatch):
+    height = GENESIS + 2300
+    chain.add_blocks([height])
+    monkeypatch.setenv('NEAR_RPC_ENDPOINTS', f'http://127.0.0.1:1/,archival:{chain.url}')
+
+    async def fetch():
+        async with AsyncClient() as client:
+            assert client.url == chain.url
+            assert isinstance(client.limiter, Limiter)
+            return await client.block(height)
+    assert asyncio.run(fetch()).result.header.height == height
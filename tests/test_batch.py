@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+
+import near_rpc
+from batch import Batcher
+from conftest import GENESIS
+
+
+def block_payload(height):
+    return dict(jsonrpc='2.0', id='dontcare', method='block', params=dict(block_id=height))
+
+
+def call_concurrently(batcher, payloads):
+    """Results of `batcher.call` on every payload, each from its own thread,
+    all started at once."""
+    barrier = threading.Barrier(len(payloads))
+    results = [None] * len(payloads)
+
+    def call(ix):
+        barrier.wait()
+        results[ix] = batcher.call(payloads[ix])
+
+    threads = [threading.Thread(target=call, args=(ix,)) for ix in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_calls_share_one_request(chain):
+    height = GENESIS + 7000
+    chain.add_blocks([height])
+    chain.faults.latency = 0.2
+    batcher = Batcher(near_rpc.near_rpc._send)
+
+    requests = chain.requests
+    results = call_concurrently(batcher, [block_payload(height)] * 16)
+    assert chain.requests - requests == 1
+    assert all(result['result']['header']['height'] == height for result in results)
+
+
+def test_rejected_batch_switches_batching_off(chain):
+    height = GENESIS + 7100
+    heights = [height + ix for ix in range(4)]
+    chain.add_blocks(heights)
+    chain.faults.batches = False
+    # Long enough for every call to be queued before the first batch.
+    batcher = Batcher(near_rpc.near_rpc._send, linger=0.1)
+
+    requests = chain.requests
+    results = call_concurrently(batcher, [block_payload(h) for h in heights])
+    assert [result['result']['header']['height'] for result in results] == heights
+    assert not batcher.batching
+    # The rejected batch, then every call on its own.
+    assert chain.requests - requests == 1 + len(heights)
+
+    requests = chain.requests
+    call_concurrently(batcher, [block_payload(h) for h in heights])
+    assert chain.requests - requests == len(heights)
+
+
+def async_calls(url, payloads):
+    from aio import AsyncClient
+
+    async def calls():
+        async with AsyncClient(url=url) as client:
+            results = await asyncio.gather(*(client.request(payload) for payload in payloads))
+            return results, client.batcher.batching
+    return asyncio.run(calls())
+
+
+def test_async_identical_calls_share_one_request(chain):
+    pytest.importorskip('aiohttp')
+    height = GENESIS + 7200
+    chain.add_blocks([height])
+
+    requests = chain.requests
+    results, _ = async_calls(chain.url, [block_payload(height)] * 16)
+    assert chain.requests - requests == 1
+    assert all(result.result.header.height == height for result in results)
+
+
+def test_async_rejected_batch_switches_batching_off(chain):
+    pytest.importorskip('aiohttp')
+    height = GENESIS + 7300
+    heights = [height + ix for ix in range(4)]
+    chain.add_blocks(heights)
+    chain.faults.batches = False
+
+    requests = chain.requests
+    results, batching = async_calls(chain.url, [block_payload(h) for h in heights])
+    assert [result.result.header.height for result in results] == heights
+    assert not batching
+    assert chain.requests - requests == 1 + len(heights)
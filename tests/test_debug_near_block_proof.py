@@ -0,0 +1,28 @@
+import hashlib
+import sys
+
+import base58 as b58
+
+import debug_near_block_proof as debug
+import store
+import utils
+from conftest import GENESIS
+
+
+def test_subtree_roots_in_shared_store(chain):
+    # `near_rpc.store` would be a second module, with its own default store.
+    assert 'near_rpc.store' not in sys.modules
+    start = GENESIS + 6000
+    chain.add_blocks([start, start + 1])
+
+    end, root = debug.get_range_forward(start, 2)
+    leaves = [b58.b58decode(chain.fixtures.lookup('block', (height,))['result']['header']['hash'])
+              for height in (start, start + 1)]
+    assert (end, root) == (start + 2, hashlib.sha256(leaves[0] + leaves[1]).digest())
+    assert store.default().get('range_forward', utils.memo_key((start, 2))) is not None
+
+    requests = chain.requests
+    saved = debug.leaves_saved()
+    assert debug.get_range_forward(start, 2) == (end, root)
+    assert chain.requests == requests
+    assert debug.leaves_saved() - saved == 2
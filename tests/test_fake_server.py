@@ -0,0 +1,17 @@
+import fake_server
+import index
+import near_rpc
+import store
+from conftest import GENESIS
+
+
+def test_replay_blocks_recorded_by_sync_client(chain):
+    height = GENESIS + 3000
+    chain.add_blocks([height, height + 1])
+    near_rpc.block(height)
+    store.default().flush()
+    index.default().flush()
+
+    fixtures = fake_server.Fixtures(memo=store.DEFAULT_PATH)
+    assert fixtures.lookup('block', (height,))['result']['header']['height'] == height
+    assert fixtures.lookup('block', (height + 5,)) is None
@@ -0,0 +1,22 @@
+
+from conftest import GENESIS
+
+import find_tx_nonce
+
+ADDRESS = '0x' + '11' * 20
+
+
+def nonce(value):
+    return {'jsonrpc': '2.0', 'id': 'dontcare', 'result': {'result': [value], 'logs': []}}
+
+
+def test_get_nonce_at_skipped_height(chain):
+    start = GENESIS + 1000
+    # No block at start + 2.
+    chain.add_blocks([start, start + 1, start + 3])
+    address = find_tx_nonce.normalize(ADDRESS)
+    chain.add('call_function', ('aurora', 'get_nonce', address, start + 1), nonce(7))
+    chain.add('call_function', ('aurora', 'get_nonce', address, start + 3), nonce(8))
+
+    assert find_tx_nonce.get_nonce(ADDRESS, start + 2) == 7
+    assert find_tx_nonce.get_nonce(ADDRESS, start + 3) == 8
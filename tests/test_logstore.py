@@ -0,0 +1,69 @@
+import pickle
+
+import pytest
+
+from logstore import HEADER, MAGIC, LogStore
+
+
+def write(path, items):
+    store = LogStore(path)
+    for key, value in items:
+        store.put(key, value)
+    store.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    path = str(tmp_path / 'log')
+    write(path, [(b'a', b'1'), (b'b', b'\x00' * 64 + b'tail')])
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 3)
+
+    store = LogStore(path)
+    assert list(store.index) == [b'a']
+    store.put(b'c', b'3')
+    store.close()
+    assert sorted(LogStore(path).index) == [b'a', b'c']
+
+
+def test_corrupted_record_in_the_middle_is_skipped(tmp_path):
+    path = str(tmp_path / 'log')
+    write(path, [(b'k%d' % i, b'v%d' % i) for i in range(5)])
+    with open(path, 'r+b') as f:
+        data = bytearray(f.read())
+        # Value of the second record.
+        data[len(MAGIC) + 2 * (HEADER.size + 4) - 1] ^= 0xff
+        f.seek(0)
+        f.write(data)
+
+    store = LogStore(path)
+    assert sorted(store.index) == [b'k0', b'k2', b'k3', b'k4']
+    assert store.get(b'k4') == b'v4'
+
+
+def test_corrupted_header_in_the_middle_raises(tmp_path):
+    path = str(tmp_path / 'log')
+    write(path, [(b'k%d' % i, b'v%d' % i) for i in range(5)])
+    with open(path, 'r+b') as f:
+        data = bytearray(f.read())
+        # Key length of the second record.
+        data[len(MAGIC) + HEADER.size + 4] = 200
+        f.seek(0)
+        f.write(data)
+
+    with pytest.raises(ValueError):
+        LogStore(path)
+    with open(path, 'rb') as f:
+        assert len(f.read()) == len(data)
+
+
+def test_legacy_pickle_is_converted(tmp_path):
+    path = str(tmp_path / 'cache.pickle')
+    key = pickle.dumps([(1,), {}])
+    with open(path, 'wb') as f:
+        pickle.dump({key: {'result': 1}}, f)
+
+    store = LogStore(path)
+    assert pickle.loads(store.get(key)) == {'result': 1}
+    store.close()
+    with open(path, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,27 @@
+import metrics
+import near_rpc
+from conftest import GENESIS
+
+
+def block_calls():
+    return metrics.REQUEST_SECONDS.labels(method='block').count
+
+
+def test_nearest_block_at_or_before_single_skip(chain):
+    start = GENESIS + 4000
+    # No block at start + 1.
+    chain.add_blocks([start, start + 2, start + 3, start + 4])
+    near_rpc.policy.final_height()
+    calls = block_calls()
+
+    assert near_rpc.nearest_block_at_or_before(start + 1).height == start
+    # The skipped height, the block after it, and the one before by hash.
+    assert block_calls() - calls == 3
+
+
+def test_nearest_block_at_or_after_long_gap(chain):
+    start = GENESIS + 5000
+    chain.add_blocks([start, start + 100])
+
+    assert near_rpc.nearest_block_at_or_after(start + 1).height == start + 100
+    assert near_rpc.nearest_block_at_or_after(start + 101) is None
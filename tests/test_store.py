@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import epochs
+import index
+import store
+
+
+def test_shared_defaults_built_once(chain):
+    for module in (store, index, epochs):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            instances = list(executor.map(lambda _: module.default(), range(32)))
+        assert all(instance is instances[0] for instance in instances)
+
+
+def test_shared_file_in_wal_mode(chain):
+    for module in (store, index, epochs):
+        conn = module.default().connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+        assert conn.execute('PRAGMA synchronous').fetchone() == (1,)
@@ -0,0 +1,196 @@
+""" Verify the block proofs of many receipts against their light client heads.
+
+    Reads rows `receipt_id receiver_id light_client_head` (separated by commas
+    or whitespace, `#` starts a comment) from a file, or stdin with `-`, and
+    writes one JSON line per receipt, in input order, with the result and its
+    timings. Throughput is printed to stderr at the end.
+
+    python verify_proofs.py receipts.csv --connections 32 > results.jsonl
+
+    Proofs and headers are fetched by `--connections` threads through the
+    shared `near_rpc` caches, so rows in the same blocks or under the same head
+    reuse each other's requests. Merkle paths are folded by a pool of
+    `--processes` workers. With `--intermediates`, every step of the proof is
+    also recomputed, from the stored subtree hashes of
+    `debug_near_block_proof` or from a `MerkleAccumulator` (`--accumulator`).
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import base58 as b58
+
+import near_rpc
+from near_rpc import RpcError, block_header, light_client_proof
+
+
+def parse(lines):
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        row = re.split(r'[,\s]+', line)
+        if len(row) != 3:
+            raise ValueError(f'Expected receipt_id, receiver_id, light_client_head: {line}')
+        if row[0] == 'receipt_id':
+            continue
+        yield tuple(row)
+
+
+def fold(leaf, path):
+    """Root of the merkle path from `leaf`. Runs in the worker processes."""
+    start = time.perf_counter()
+    value = leaf
+    for inner, direction in path:
+        value = hashlib.sha256(value + inner if direction == 'Right' else inner + value).digest()
+    return value, time.perf_counter() - start
+
+
+def intermediate_errors(height, head_height, path, accumulator):
+    """`(checked, errors)`: steps of `path` compared with the subtree they
+    claim to be the root of, and how many differ.
+
+    With an accumulator holding both blocks the whole path is known.
+    Otherwise the subtrees are rebuilt by `debug_near_block_proof`, whose
+    stored subtree hashes are shared by every receipt; that only holds
+    inside the complete subtree of the block, so the walk stops where it
+    would reach the head."""
+    if accumulator is not None and (accumulator.ordinal(height) is None or
+                                    accumulator.ordinal(head_height) is None):
+        accumulator = None
+    if accumulator is not None:
+        expected = accumulator.proof(accumulator.ordinal(height), accumulator.ordinal(head_height))
+        errors = sum(a != b for a, b in zip(path, expected)) + abs(len(path) - len(expected))
+        return max(len(path), len(expected)), errors
+
+    import debug_near_block_proof as debug
+
+    left, right = height, height + 1
+    checked = errors = 0
+    for step, (inner, direction) in enumerate(path):
+        if right >= head_height:
+            break
+        if direction == 'Right':
+            right, hash = debug.get_range_forward(right, 1 << step)
+            if right > head_height:
+                break
+        else:
+            left, hash = debug.get_range_backward(left, 1 << step)
+        checked += 1
+        errors += hash != inner
+    return checked, errors
+
+
+def fetch(row, intermediates, accumulator):
+    receipt_id, receiver_id, head = row
+    result = dict(receipt_id=receipt_id, receiver_id=receiver_id, light_client_head=head)
+    start = time.perf_counter()
+    try:
+        proof = light_client_proof.raw(receipt_id, head, receiver_id)
+        if 'error' in proof:
+            raise RpcError(proof['error'])
+        proof = proof['result']
+
+        height = proof['block_header_lite']['inner_lite']['height']
+        path = [(b58.b58decode(step['hash']), step['direction']) for step in proof['block_proof']]
+        base = block_header(head)
+        result.update(height=height, leaf=block_header(height).hash, path=path, expected=base.block_merkle_root)
+        if intermediates:
+            result['intermediate_checked'], result['intermediate_errors'] = \
+                intermediate_errors(height, base.height, path, accumulator)
+    except Exception as e:
+        # One bad row or failed request must not stop the batch.
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['fetch_seconds'] = time.perf_counter() - start
+    return result
+
+
+def finish(result, folded):
+    if folded is not None:
+        root, result['fold_seconds'] = folded if isinstance(folded, tuple) else folded.result()
+        result['ok'] = root == result['expected'] and not result.get('intermediate_errors')
+        if root != result['expected']:
+            result['error'] = f'Root {b58.b58encode(root).decode()} != ' \
+                              f'{b58.b58encode(result["expected"]).decode()}'
+        elif result.get('intermediate_errors'):
+            result['error'] = f'{result["intermediate_errors"]} intermediate hashes differ'
+    else:
+        result['ok'] = False
+    for key in ('leaf', 'path', 'expected'):
+        result.pop(key, None)
+    return result
+
+
+def verify(rows, connections=16, processes=None, intermediates=False, accumulator=None):
+    """Yield the result of every row, in order. At most a few times
+    `connections` rows are fetched ahead of the output, so `rows` can be an
+    endless stream."""
+    fetcher = ThreadPoolExecutor(max_workers=connections)
+    folder = ProcessPoolExecutor(max_workers=processes) if processes != 0 else None
+    fetching, folding = deque(), deque()
+
+    def fold_next():
+        result = fetching.popleft().result()
+        if 'error' in result:
+            folded = None
+        elif folder is not None:
+            folded = folder.submit(fold, result['leaf'], result['path'])
+        else:
+            folded = fold(result['leaf'], result['path'])
+        folding.append((result, folded))
+
+    try:
+        for row in rows:
+            fetching.append(fetcher.submit(fetch, row, intermediates, accumulator))
+            while len(fetching) > 2 * connections:
+                fold_next()
+            while len(folding) > 2 * connections:
+                yield finish(*folding.popleft())
+        while fetching:
+            fold_next()
+        while folding:
+            yield finish(*folding.popleft())
+    finally:
+        fetcher.shutdown(wait=False, cancel_futures=True)
+        if folder is not None:
+            folder.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='File with one receipt per line, or - for stdin')
+    parser.add_argument('--connections', type=int, default=16, help='Concurrent RPC requests')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='Processes folding merkle paths; 0 folds in the main process')
+    parser.add_argument('--intermediates', action='store_true', help='Also check every step of the proofs')
+    parser.add_argument('--accumulator', help='MerkleAccumulator path used by --intermediates')
+    args = parser.parse_args()
+
+    near_rpc.configure(pool_size=args.connections)
+    accumulator = None
+    if args.accumulator is not None:
+        from near_rpc.mmr import MerkleAccumulator
+        accumulator = MerkleAccumulator(args.accumulator, writable=False)
+
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    start = time.perf_counter()
+    total = passed = 0
+    for result in verify(parse(lines), args.connections, args.processes, args.intermediates, accumulator):
+        total += 1
+        passed += result['ok']
+        print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f'{total} receipts, {passed} passed, {total - passed} failed in {elapsed:.1f}s '
+          f'({total / elapsed if elapsed else 0:.1f} receipts/s)', file=sys.stderr)
+    exit(0 if passed == total else 1)
+
+
+if __name__ == '__main__':
+    main()